@@ -0,0 +1,511 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+from TrackCommon import read_result_from_binary, write_result_to_binary
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+BENCHMARK_DIR = os.path.join("processedTracks", "benchmark")
+DEFAULT_SIZES = (512, 1024, 2048)
+DEFAULT_CNN_MODEL = os.path.join("CNN", "best_modelv2.keras")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+BOUNDARY_KEYS = ("outer_boundary", "inner_boundary")
+
+# Track centre lines as a radius multiplier around an ellipse, r(theta)
+SYNTHETIC_SHAPES = {
+    "oval": lambda theta: np.ones_like(theta),
+    "trefoil": lambda theta: 1.0 + 0.2 * np.sin(3 * theta),
+    "kidney": lambda theta: 1.0 + 0.18 * np.sin(2 * theta) + 0.1 * np.cos(theta),
+}
+GRASS_BGR = (80, 180, 100)
+ASPHALT_BGR = (48, 48, 52)
+
+
+def synthetic_track(shape, width, seed=0):
+    """Draw a dark closed track on a grass-coloured background.
+
+    The image is ``width`` wide with a 4:3 aspect ratio. Returns the image
+    and a result dict holding the exact outer and inner boundaries, which
+    serve as ground truth for the boundary deltas.
+    """
+    height = width * 3 // 4
+    theta = np.linspace(0, 2 * np.pi, 2048, endpoint=False)
+    radius = SYNTHETIC_SHAPES[shape](theta)
+    centre = np.stack(
+        [
+            width / 2 + 0.36 * width * radius * np.cos(theta),
+            height / 2 + 0.36 * height * radius * np.sin(theta),
+        ],
+        axis=1,
+    )
+
+    # Offset the centre line along its normal by half the track width
+    tangent = np.roll(centre, -1, axis=0) - np.roll(centre, 1, axis=0)
+    normal = np.stack([tangent[:, 1], -tangent[:, 0]], axis=1)
+    normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+    if np.sum(normal * (centre - centre.mean(axis=0))) < 0:
+        normal = -normal
+    half_width = max(4.0, 0.025 * width)
+    outer = centre + normal * half_width
+    inner = centre - normal * half_width
+
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = GRASS_BGR
+    shift = 4
+    for polygon, colour in ((outer, ASPHALT_BGR), (inner, GRASS_BGR)):
+        points = np.round(polygon * (1 << shift)).astype(np.int32)
+        cv.fillPoly(img, [points], colour, cv.LINE_AA, shift)
+    noise = rng.normal(0, 6, img.shape)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+
+    truth = {
+        "success": True,
+        "error": None,
+        "outer_boundary": outer.astype(np.float32),
+        "inner_boundary": inner.astype(np.float32),
+    }
+    return img, truth
+
+
+def build_corpus(corpus_dir, sizes, real_dir=None, shapes=SYNTHETIC_SHAPES):
+    """Write the benchmark images for every size and return their descriptions.
+
+    Real images are resized to each width, keeping their aspect ratio, and
+    synthetic tracks are drawn at each width with a ground-truth ``.bin``
+    next to them. Existing files are reused, so the corpus is only generated
+    once per directory.
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    images = []
+
+    real_paths = []
+    if real_dir and os.path.isdir(real_dir):
+        real_paths = sorted(
+            os.path.join(real_dir, name) for name in os.listdir(real_dir) if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    for size in sizes:
+        for source_path in real_paths:
+            stem = os.path.splitext(os.path.basename(source_path))[0]
+            path = os.path.join(corpus_dir, f"{stem}_{size}.png")
+            if not os.path.exists(path):
+                source = cv.imread(source_path)
+                if source is None:
+                    continue
+                height = round(source.shape[0] * size / source.shape[1])
+                interpolation = cv.INTER_AREA if size < source.shape[1] else cv.INTER_CUBIC
+                cv.imwrite(path, cv.resize(source, (size, height), None, 0, 0, interpolation))
+            images.append({"name": f"{stem}_{size}", "kind": "real", "size": size, "path": path})
+
+        for shape in shapes:
+            name = f"synthetic_{shape}_{size}"
+            path = os.path.join(corpus_dir, name + ".png")
+            truth_path = os.path.join(corpus_dir, name + ".truth.bin")
+            if not (os.path.exists(path) and os.path.exists(truth_path)):
+                img, truth = synthetic_track(shape, size)
+                cv.imwrite(path, img)
+                write_result_to_binary(truth, truth_path)
+            images.append(
+                {
+                    "name": name,
+                    "kind": "synthetic",
+                    "size": size,
+                    "path": path,
+                    "truth": truth_path,
+                }
+            )
+
+    return images
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown"""
+    # On Linux ru_maxrss keeps the parent's peak in spawned children, while
+    # VmHWM covers only this process's own address space
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_processor(name, cnn_model=DEFAULT_CNN_MODEL):
+    if name == "track":
+        from TrackProcessor import TrackProcessor
+
+        return TrackProcessor()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "CNN"))
+    from CNN import CNNTrackProcessor
+
+    return CNNTrackProcessor(cnn_model)
+
+
+def run_processor(name, images, repeat=3, cnn_model=DEFAULT_CNN_MODEL):
+    """Time one processor over the corpus; runs in its own process for RSS"""
+    processor = make_processor(name, cnn_model)
+    # The first call pays for lazy initialisation (TensorFlow graph tracing)
+    if images:
+        processor.processImageForCSharp(images[0]["path"])
+
+    records = []
+    for image in images:
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = processor.processImageForCSharp(image["path"])
+            seconds.append(time.perf_counter() - start)
+
+        records.append(
+            {
+                "name": image["name"],
+                "seconds": seconds,
+                "success": result["success"],
+                "error": result["error"],
+                "peak_rss_mb": peak_rss_mb(),
+                "result": {key: result[key] for key in BOUNDARY_KEYS},
+            }
+        )
+    return records
+
+
+def boundary_distances(points, reference, shape):
+    """Distance from each point to the nearest pixel of the reference polyline"""
+    canvas = np.full(shape, 255, dtype=np.uint8)
+    cv.polylines(canvas, [np.round(reference).astype(np.int32)], True, 0)
+    distance = cv.distanceTransform(canvas, cv.DIST_L2, cv.DIST_MASK_PRECISE)
+    pixels = np.round(points).astype(np.int64)
+    x = np.clip(pixels[:, 0], 0, shape[1] - 1)
+    y = np.clip(pixels[:, 1], 0, shape[0] - 1)
+    return distance[y, x]
+
+
+def boundary_delta(result, reference, shape):
+    """Symmetric mean and maximum (Hausdorff) distance between two results' boundaries"""
+    delta = {}
+    for key in BOUNDARY_KEYS:
+        points = np.asarray(result[key], dtype=np.float32).reshape(-1, 2)
+        expected = np.asarray(reference[key], dtype=np.float32).reshape(-1, 2)
+        if len(points) == 0 or len(expected) == 0:
+            delta[key] = None
+            continue
+        distances = np.concatenate(
+            [
+                boundary_distances(points, expected, shape),
+                boundary_distances(expected, points, shape),
+            ]
+        )
+        delta[key] = {
+            "mean_px": float(distances.mean()),
+            "max_px": float(distances.max()),
+        }
+    return delta
+
+
+def delta_totals(deltas):
+    """Mean and max over the outer and inner deltas, None if either is missing"""
+    if not deltas or any(deltas[key] is None for key in BOUNDARY_KEYS):
+        return None
+    return {
+        "mean_px": float(np.mean([deltas[key]["mean_px"] for key in BOUNDARY_KEYS])),
+        "max_px": float(max(deltas[key]["max_px"] for key in BOUNDARY_KEYS)),
+    }
+
+
+def summarize_group(records):
+    """Throughput, latency percentiles, RSS and accuracy for one size"""
+    seconds = [s for record in records for s in record["seconds"]]
+    summary = {
+        "images": len(records),
+        "failed": sum(not record["success"] for record in records),
+        "images_per_second": len(seconds) / sum(seconds) if sum(seconds) else 0.0,
+        "p50_ms": float(np.percentile(seconds, 50) * 1000) if seconds else None,
+        "p95_ms": float(np.percentile(seconds, 95) * 1000) if seconds else None,
+        "peak_rss_mb": max(
+            (record["peak_rss_mb"] for record in records if record["peak_rss_mb"]),
+            default=None,
+        ),
+    }
+
+    for kind in ("reference", "truth"):
+        totals = [delta_totals(record.get(kind + "_delta")) for record in records if record.get(kind + "_delta") is not None]
+        compared = [total for total in totals if total is not None]
+        summary[kind + "_delta"] = (
+            {
+                "images": len(totals),
+                "missing_boundaries": len(totals) - len(compared),
+                "mean_px": float(np.mean([t["mean_px"] for t in compared])),
+                "max_px": float(max(t["max_px"] for t in compared)),
+            }
+            if compared
+            else None
+        )
+    return summary
+
+
+def run_benchmark(
+    processors,
+    sizes=DEFAULT_SIZES,
+    real_dir="TEST",
+    shapes=tuple(SYNTHETIC_SHAPES),
+    repeat=3,
+    cnn_model=DEFAULT_CNN_MODEL,
+    corpus_dir=os.path.join(BENCHMARK_DIR, "corpus"),
+    references_dir=os.path.join(BENCHMARK_DIR, "references"),
+    update_references=False,
+):
+    """Benchmark each processor over the corpus and return the report dict.
+
+    Every processor runs in a fresh process so its peak RSS is its own.
+    Boundaries are compared with the stored reference result for that
+    processor and image, and with the ground truth of synthetic tracks.
+    Images without a stored reference are listed under
+    ``missing_references``. ``update_references`` replaces the stored
+    references with this run's successful results.
+    """
+    images = build_corpus(corpus_dir, sorted(sizes), real_dir, shapes)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv.__version__,
+            "numpy": np.__version__,
+        },
+        "settings": {
+            "sizes": sorted(sizes),
+            "real_dir": real_dir,
+            "shapes": list(shapes),
+            "repeat": repeat,
+            "cnn_model": cnn_model,
+        },
+        "processors": {},
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for name in processors:
+        if name == "cnn" and not os.path.exists(cnn_model):
+            report["processors"][name] = {"skipped": f"Model not found: {cnn_model}"}
+            continue
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            records = pool.submit(run_processor, name, images, repeat, cnn_model).result()
+
+        reference_dir = os.path.join(references_dir, name)
+        missing_references = []
+        for image, record in zip(images, records):
+            result = record.pop("result")
+            shape = cv.imread(image["path"], cv.IMREAD_GRAYSCALE).shape
+            reference_path = os.path.join(reference_dir, image["name"] + ".bin")
+
+            record["reference_delta"] = None
+            if not os.path.exists(reference_path):
+                missing_references.append(image["name"])
+            elif record["success"]:
+                reference = read_result_from_binary(reference_path)
+                record["reference_delta"] = boundary_delta(result, reference, shape)
+
+            record["truth_delta"] = None
+            if "truth" in image:
+                truth = read_result_from_binary(image["truth"])
+                record["truth_delta"] = boundary_delta(result, truth, shape)
+
+            if update_references and record["success"]:
+                os.makedirs(reference_dir, exist_ok=True)
+                write_result_to_binary(dict(result, success=True, error=None), reference_path)
+
+            record["kind"] = image["kind"]
+            record["size"] = image["size"]
+
+        report["processors"][name] = {
+            "skipped": None,
+            "groups": [
+                dict(
+                    size=size,
+                    **summarize_group([record for record in records if record["size"] == size]),
+                )
+                for size in sorted(sizes)
+            ],
+            "images": records,
+            "missing_references": [] if update_references else missing_references,
+        }
+
+    return report
+
+
+def _format_delta(delta):
+    if delta is None:
+        return "-"
+    return f"{delta['mean_px']:.2f}/{delta['max_px']:.1f}"
+
+
+def print_report(report):
+    print(
+        f"{'processor':<10}{'size':>6}{'images':>8}{'failed':>8}{'img/s':>9}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'RSS MB':>9}  {'ref mean/max':>13}"
+        f"  {'truth mean/max':>14}"
+    )
+    for name, entry in report["processors"].items():
+        if entry["skipped"]:
+            print(f"{name:<10} skipped: {entry['skipped']}")
+            continue
+        for group in entry["groups"]:
+            rss = f"{group['peak_rss_mb']:.0f}" if group["peak_rss_mb"] else "-"
+            p50 = f"{group['p50_ms']:.1f}" if group["p50_ms"] is not None else "-"
+            p95 = f"{group['p95_ms']:.1f}" if group["p95_ms"] is not None else "-"
+            print(
+                f"{name:<10}{group['size']:>6}{group['images']:>8}{group['failed']:>8}"
+                f"{group['images_per_second']:>9.2f}{p50:>10}{p95:>10}{rss:>9}"
+                f"  {_format_delta(group['reference_delta']):>13}"
+                f"  {_format_delta(group['truth_delta']):>14}"
+            )
+
+
+def print_comparison(report, baseline):
+    """Print the p50 speedup and accuracy change of each group against a baseline"""
+    print(f"\nCompared with the run from {baseline.get('created', 'unknown')}:")
+    for name, entry in report["processors"].items():
+        old_entry = baseline.get("processors", {}).get(name)
+        if entry["skipped"] or not old_entry or old_entry.get("skipped"):
+            continue
+        old_groups = {group["size"]: group for group in old_entry["groups"]}
+        for group in entry["groups"]:
+            old = old_groups.get(group["size"])
+            if old is None or not group["p50_ms"] or not old["p50_ms"]:
+                continue
+            line = (
+                f"{name:<10}{group['size']:>6}  p50 {old['p50_ms']:.1f} -> "
+                f"{group['p50_ms']:.1f} ms ({old['p50_ms'] / group['p50_ms']:.2f}x)"
+            )
+            new_truth, old_truth = group["truth_delta"], old["truth_delta"]
+            if new_truth and old_truth:
+                line += f", truth mean {old_truth['mean_px']:.2f} -> {new_truth['mean_px']:.2f} px"
+            print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark track boundary extraction over real and synthetic images")
+    parser.add_argument(
+        "--processors",
+        nargs="+",
+        choices=["track", "cnn"],
+        default=["track", "cnn"],
+        help="Processors to benchmark (default: both; cnn is skipped without a model)",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=list(DEFAULT_SIZES),
+        help="Image widths in pixels (default: 512 1024 2048)",
+    )
+    parser.add_argument(
+        "--real-dir",
+        default="TEST",
+        help="Directory of real track images to include (default: TEST)",
+    )
+    parser.add_argument(
+        "--shapes",
+        nargs="*",
+        choices=list(SYNTHETIC_SHAPES),
+        default=list(SYNTHETIC_SHAPES),
+        help="Synthetic track shapes to include (default: all)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image (default: 3)")
+    parser.add_argument(
+        "--cnn-model",
+        default=DEFAULT_CNN_MODEL,
+        help=f"Keras model for the cnn processor (default: {DEFAULT_CNN_MODEL})",
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        default=os.path.join(BENCHMARK_DIR, "corpus"),
+        help="Where the resized and synthetic images are generated",
+    )
+    parser.add_argument(
+        "--references-dir",
+        default=os.path.join(BENCHMARK_DIR, "references"),
+        help="Stored reference boundaries, one .bin per processor and image",
+    )
+    parser.add_argument(
+        "--update-references",
+        action="store_true",
+        help="Store this run's boundaries as the new references",
+    )
+    parser.add_argument(
+        "--output",
+        help="Report path (default: processedTracks/benchmark/results/<time>.json)",
+    )
+    parser.add_argument("--compare", metavar="REPORT", help="Earlier report to compare this run with")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    report = run_benchmark(
+        args.processors,
+        args.sizes,
+        args.real_dir,
+        args.shapes,
+        max(1, args.repeat),
+        args.cnn_model,
+        args.corpus_dir,
+        args.references_dir,
+        args.update_references,
+    )
+
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", time.strftime("benchmark_%Y%m%d_%H%M%S.json"))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+    print(f"\nReport written to {output}")
+
+    missing = {
+        name: entry["missing_references"]
+        for name, entry in report["processors"].items()
+        if not entry["skipped"] and entry["missing_references"]
+    }
+    # Only a processor with stored references fails the run; the others
+    # have nothing to regress against yet
+    failed = False
+    for name, names in missing.items():
+        reference_dir = os.path.join(args.references_dir, name)
+        print(
+            f"{name}: no reference for {len(names)} images in {reference_dir} "
+            f"({', '.join(names[:3])}{', ...' if len(names) > 3 else ''}); "
+            "run with --update-references to store them",
+            file=sys.stderr,
+        )
+        failed = failed or os.path.isdir(reference_dir)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
+import argparse
 import json
 import os
 import sys
+import tempfile
+import time
+from collections import Counter
+from functools import partial
+from multiprocessing import get_context
 
 import cv2 as cv
 import numpy as np
-from scipy.interpolate import interp1d
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"  # or '2' to keep warnings but hide INFO
 import matplotlib.pyplot as plt
@@ -12,22 +17,100 @@ from PIL import Image
 from scipy import ndimage
 from skimage import measure, morphology
 from skimage.morphology import dilation, erosion, skeletonize
-from tensorflow.keras.models import load_model
 
-NUM_EDGE_POINTS = 4550  # Fixed number of points for each boundary
+# Shared helpers live next to TrackProcessor.py in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ModelRegistry import (  # noqa: E402
+    TFLITE_EXTENSION,
+    get_model,
+    set_thread_budget,
+)
+from Morphology import ENGINES as MORPHOLOGY_ENGINES  # noqa: E402
+from Morphology import MorphologyEngine  # noqa: E402
+from Pipeline import run_pipelined  # noqa: E402
+from ResultCache import ResultCache  # noqa: E402
+from StageTimer import StageTimer  # noqa: E402
+from TileCache import DEFAULT_TILE_CACHE_BYTES, DEFAULT_TILE_DISK_BYTES, TileCache  # noqa: E402
+from TilePrefilter import TilePrefilter  # noqa: E402
+from TrackCommon import (  # noqa: E402
+    NUM_EDGE_POINTS,
+    failure_result,
+    resample_contour,
+    result_to_json,
+    write_result,
+)
+from TrackProcessor import (  # noqa: E402
+    BATCH_SUMMARY_NAME,
+    add_service_arguments,
+    collect_images,
+    run_batch,
+    run_worker,
+)
 
 
 def remove_small_regions(mask, min_area=5000):
     """Remove small connected components (blobs/warts) from binary mask."""
-    num_labels, labels, stats, _ = cv.connectedComponentsWithStats(mask, connectivity=8)
-    cleaned = np.zeros_like(mask)
-
-    for i in range(1, num_labels):  # skip background
-        area = stats[i, cv.CC_STAT_AREA]
-        if area >= min_area:
-            cleaned[labels == i] = 255
-
-    return cleaned
+    _, labels, stats, _ = cv.connectedComponentsWithStats(mask, connectivity=8)
+    # One lookup per pixel: label -> 255 for kept components, 0 otherwise
+    keep = np.where(stats[:, cv.CC_STAT_AREA] >= min_area, 255, 0).astype(mask.dtype)
+    keep[0] = 0  # background
+    return keep[labels]
+
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def remove_small_regions_streaming(mask, min_area=5000, strip_rows=1024, out=None):
+    """remove_small_regions over row strips with a union-find across strip borders; same output, one strip in memory"""
+    height, width = mask.shape[:2]
+    if out is None:
+        out = np.zeros((height, width), dtype=np.uint8)
+
+    def label_strip(top):
+        strip = np.ascontiguousarray(mask[top : top + strip_rows], dtype=np.uint8)
+        return cv.connectedComponentsWithStats(strip, connectivity=8)[1:3]
+
+    # Global component ids: strip label l > 0 becomes firsts[strip] + l - 1
+    parent, areas, firsts = [], [], []
+    previous_row = None
+    for top in range(0, height, strip_rows):
+        labels, stats = label_strip(top)
+        first = len(parent)
+        firsts.append(first)
+        parent.extend(range(first, first + len(stats) - 1))
+        areas.extend(stats[1:, cv.CC_STAT_AREA])
+
+        row = np.where(labels[0] > 0, first + labels[0] - 1, -1)
+        if previous_row is not None:
+            for dx in (-1, 0, 1):
+                above = previous_row[max(0, -dx) : width - max(0, dx)]
+                below = row[max(0, dx) : width - max(0, -dx)]
+                touching = (above >= 0) & (below >= 0)
+                pairs = np.unique(np.stack([above[touching], below[touching]]), axis=1)
+                for a, b in pairs.T:
+                    root_a, root_b = _find(parent, a), _find(parent, b)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+        previous_row = np.where(labels[-1] > 0, first + labels[-1] - 1, -1)
+
+    roots = np.array([_find(parent, i) for i in range(len(parent))], dtype=np.int64)
+    root_areas = np.bincount(roots, weights=areas, minlength=len(parent))
+    kept = root_areas[roots] >= min_area
+
+    for strip, top in enumerate(range(0, height, strip_rows)):
+        labels, stats = label_strip(top)
+        first = firsts[strip]
+        keep = np.zeros(len(stats), dtype=np.uint8)
+        keep[1:] = np.where(kept[first : first + len(stats) - 1], 255, 0)
+        out[top : top + strip_rows] = keep[labels]
+
+    return out
 
 
 def smooth_contour(contour, epsilon_ratio=0.0001):
@@ -39,36 +122,146 @@ def smooth_contour(contour, epsilon_ratio=0.0001):
 
 
 class CNNTrackProcessor:
-    def __init__(self, model_path="best_modelv2.keras"):
-        self.model = load_model(model_path, compile=False)
+    # Tile offsets averaged by generate_track_mask_enhanced
+    ENSEMBLE_OFFSETS = [(0, 0), (64, 0), (0, 64), (64, 64), (32, 32)]
+    BLACK_THRESHOLD = 0.85
+    MASK_THRESHOLD = 0.2
+    MIN_REGION_AREA = 20000
+    GAP_SIZE = 10
+    # Tiles per model call in predict_on_tiles
+    BATCH_SIZE = 32
+    # "tiles" runs the offset ensemble on 128 px tiles, "window" runs the
+    # fully convolutional U-Net once over large windows with a halo,
+    # "adaptive" runs the later offsets only where the first is uncertain
+    INFERENCE_MODES = ("tiles", "window", "adaptive")
+    WINDOW_SIZE = 512
+    WINDOW_HALO = 32
+    # "keras" runs the full model, "tflite" an export made by ModelExport.py
+    BACKENDS = ("keras", "tflite")
+    # Tile weighting in the ensemble: "flat" is the plain mean over offsets,
+    # "cosine" and "gaussian" fade each tile's prediction towards its border
+    BLEND_WINDOWS = ("flat", "cosine", "gaussian")
+    # First-pass probabilities within this distance of MASK_THRESHOLD get
+    # the remaining offset passes in adaptive inference
+    UNCERTAINTY_BAND = 0.1
+    # Batches waiting between the pipelined tiling, inference and stitching
+    PIPELINE_DEPTH = 2
+
+    def __init__(
+        self,
+        model_path="best_modelv2.keras",
+        result_cache=None,
+        instrument=False,
+        batch_size=BATCH_SIZE,
+        inference="tiles",
+        window_size=WINDOW_SIZE,
+        window_halo=WINDOW_HALO,
+        backend=None,
+        blend="flat",
+        float16=False,
+        uncertainty_band=UNCERTAINTY_BAND,
+        check_adaptive=False,
+        prefilter=None,
+        pipeline=False,
+        morphology_engine="opencv",
+        morphology_downsample=1,
+        tile_cache=None,
+        incremental=False,
+    ):
+        if inference not in self.INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode: {inference}")
+        if blend not in self.BLEND_WINDOWS:
+            raise ValueError(f"Unknown blend window: {blend}")
+        if incremental and inference != "tiles":
+            raise ValueError("Incremental segmentation needs tile inference")
+        # Without an explicit backend the model file's extension decides
+        is_tflite = model_path.lower().endswith(TFLITE_EXTENSION)
+        backend = backend or ("tflite" if is_tflite else "keras")
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        if (backend == "tflite") != is_tflite:
+            raise ValueError(f"The {backend} backend cannot load {model_path}")
+        if backend == "tflite" and inference == "window":
+            raise ValueError("Window inference needs the keras backend")
+        self.backend = backend
+        self.model_path = model_path
+        self.batch_size = max(1, int(batch_size))
+        self.inference = inference
+        # The U-Net pools four times, so window inputs must be multiples of 16
+        self.window_size = max(16, -(-int(window_size) // 16) * 16)
+        self.window_halo = max(0, -(-int(window_halo) // 8) * 8)
+        self.blend = blend
+        # Storage type of the ensemble accumulator
+        self.float16 = float16
+        self.uncertainty_band = uncertainty_band
+        # Also run the full ensemble to report the adaptive mask's agreement
+        self.check_adaptive = check_adaptive
+        self.adaptive_stats = None
+        # Calibrated TilePrefilter file; its skipped tiles predict zero
+        self.prefilter_path = prefilter
+        self.prefilter = TilePrefilter.load(prefilter) if prefilter else None
+        self.prefilter_stats = None
+        # Overlap tiling and stitching with inference on separate threads
+        self.pipeline = pipeline
+        # Erode/dilate/close for the cleanup and inner boundary fallback
+        self.morphology = MorphologyEngine(morphology_engine, morphology_downsample)
+        # Per-tile predictions shared across offsets and images
+        self.tile_cache = tile_cache
+        self.tile_cache_stats = None
+        # Model part of the tile cache keys, cleared when the model is refreshed
+        self.tile_model_id = None
+        # Running model time per predicted tile, to price cache hits
+        self.inference_seconds = 0.0
+        self.inferred_tiles = 0
+        # Re-infer only tiles near pixels that changed since the last image
+        self.incremental = incremental
+        self.incremental_state = None
+        self.incremental_stats = None
+        # Shared with every processor in this process that uses the same file
+        self.model = get_model(model_path)
         self.original_image = None
         self.track_mask = None
         self.track_boundaries = None
+        self.result_cache = result_cache
+        # Per-stage wall time and peak memory, reported under "timings"
+        self.timer = StageTimer(instrument)
+
+    def pipelineParams(self):
+        """Parameters that determine the output, used to key cached results"""
+        model_stat = os.stat(self.model_path)
+        params = {
+            "processor": "CNNTrackProcessor",
+            "backend": self.backend,
+            "model": [
+                os.path.abspath(self.model_path),
+                model_stat.st_size,
+                model_stat.st_mtime_ns,
+            ],
+            "ensemble_offsets": self.ENSEMBLE_OFFSETS,
+            "black_threshold": self.BLACK_THRESHOLD,
+            "mask_threshold": self.MASK_THRESHOLD,
+            "min_region_area": self.MIN_REGION_AREA,
+            "gap_size": self.GAP_SIZE,
+            "num_edge_points": NUM_EDGE_POINTS,
+        }
+        if self.inference == "window":
+            params["window"] = [self.window_size, self.window_halo]
+            del params["ensemble_offsets"]
+        else:
+            params["blend"] = self.blend
+        if self.inference == "adaptive":
+            params["uncertainty_band"] = self.uncertainty_band
+        if self.float16:
+            params["float16"] = True
+        if self.prefilter is not None:
+            params["prefilter"] = self.prefilter.thresholds
+        if self.morphology.params() != ["opencv", 1]:
+            params["morphology"] = self.morphology.params()
+        return params
 
     def resampleContour(self, contour, target_points=NUM_EDGE_POINTS):
         """Resample contour to fixed number of points - same as original"""
-        if len(contour) < 2:
-            return []
-
-        contour = contour.squeeze()
-        if contour.ndim != 2:
-            contour = contour.reshape(-1, 2)
-
-        x = contour[:, 0]
-        y = contour[:, 1]
-        dist = np.sqrt(np.diff(x) ** 2 + np.diff(y) ** 2)
-        dist = np.concatenate([[0], np.cumsum(dist)])
-
-        if dist[-1] == 0:
-            return [[float(x[i]), float(y[i])] for i in range(len(x))]
-
-        interp_dist = np.linspace(0, dist[-1], target_points)
-        interp_func_x = interp1d(dist, x, kind="linear")
-        interp_func_y = interp1d(dist, y, kind="linear")
-        x_interp = interp_func_x(interp_dist)
-        y_interp = interp_func_y(interp_dist)
-
-        return [[float(x), float(y)] for x, y in zip(x_interp, y_interp)]
+        return resample_contour(contour, target_points)
 
     def should_ignore_tile(
         self, tile_array, black_threshold=1.0, black_color=(0, 0, 0)
@@ -84,45 +277,49 @@ class CNNTrackProcessor:
 
         return black_percentage >= black_threshold
 
+    def tile_origins(self, image_shape, tile_size=(128, 128), offset=(0, 0)):
+        """x and y starts of the tiles for an offset, skipping edge tiles smaller than half a tile"""
+        height, width = image_shape[:2]
+        tile_w, tile_h = tile_size
+        xs = np.arange(offset[0], width, tile_w)
+        xs = xs[np.minimum(xs + tile_w, width) - xs >= tile_w // 2]
+        ys = np.arange(offset[1], height, tile_h)
+        ys = ys[np.minimum(ys + tile_h, height) - ys >= tile_h // 2]
+        return xs, ys
+
     def tile_image_with_offset(
         self, image, tile_size=(128, 128), offset=(0, 0), black_threshold=0.85
     ):
         """Splits an image into tiles with a given offset, filtering out predominantly black tiles."""
-        if isinstance(image, np.ndarray):
-            image = Image.fromarray(image)
-
-        width, height = image.size
-        tiles = []
-        tile_coordinates = []
-        tile_ignore_mask = []
-
-        for y in range(offset[1], height, tile_size[1]):
-            for x in range(offset[0], width, tile_size[0]):
-                x_end = min(x + tile_size[0], width)
-                y_end = min(y + tile_size[1], height)
-
-                if (x_end - x) < tile_size[0] // 2 or (y_end - y) < tile_size[1] // 2:
-                    continue
-
-                tile = image.crop((x, y, x_end, y_end))
-
-                if tile.size != tile_size:
-                    new_tile = Image.new("RGB", tile_size, (0, 0, 0))
-                    new_tile.paste(tile, (0, 0))
-                    tile = new_tile
-
-                tile_array = np.array(tile)
-                ignore_tile = self.should_ignore_tile(tile_array, black_threshold)
-
-                if not ignore_tile:
-                    tiles.append(tile_array)
-                    tile_coordinates.append((x, y))
-                else:
-                    tile_coordinates.append((x, y))
-
-                tile_ignore_mask.append(ignore_tile)
+        image = np.asarray(image)
+        tile_w, tile_h = tile_size
+        xs, ys = self.tile_origins(image.shape, tile_size, offset)
+        channels = image.shape[2:]
+        if len(xs) == 0 or len(ys) == 0:
+            return np.empty((0, tile_h, tile_w, *channels), np.uint8), [], []
+
+        # Region covered by the grid, zero-padded past the right and bottom
+        x0, y0 = int(xs[0]), int(ys[0])
+        rows, cols = len(ys), len(xs)
+        region = image[y0 : y0 + rows * tile_h, x0 : x0 + cols * tile_w]
+        if region.shape[:2] != (rows * tile_h, cols * tile_w):
+            padded = np.zeros((rows * tile_h, cols * tile_w, *channels), np.uint8)
+            padded[: region.shape[0], : region.shape[1]] = region
+            region = padded
+
+        # (rows, cols, tile_h, tile_w, channels) view of the region
+        grid = region.reshape(rows, tile_h, cols, tile_w, *channels).swapaxes(1, 2)
+
+        if channels == (3,):
+            black = (region[..., 0] | region[..., 1] | region[..., 2]) == 0
+            black_pixels = black.reshape(rows, tile_h, cols, tile_w).sum(axis=(1, 3))
+            ignore = black_pixels / (tile_h * tile_w) >= black_threshold
+        else:
+            ignore = np.zeros((rows, cols), dtype=bool)
 
-        return tiles, tile_coordinates, tile_ignore_mask
+        tiles = grid[~ignore]
+        tile_coordinates = [(int(x), int(y)) for y in ys for x in xs]
+        return tiles, tile_coordinates, ignore.ravel().tolist()
 
     def preprocess_tile(self, tile):
         """Preprocess tile to match training data format"""
@@ -131,23 +328,63 @@ class CNNTrackProcessor:
 
     def predict_on_tiles(self, tiles, ignore_mask):
         """Run prediction on tiles, handling ignored tiles"""
-        predictions = []
-        tile_index = 0
+        blank_prediction = np.zeros((128, 128, 1), dtype=np.float32)
+        predictions = [blank_prediction] * len(ignore_mask)
+        if len(tiles) == 0:
+            return predictions
 
-        for i, ignore in enumerate(ignore_mask):
-            if ignore:
-                blank_prediction = np.zeros((128, 128, 1), dtype=np.float32)
-                predictions.append(blank_prediction)
-            else:
-                processed_tile = self.preprocess_tile(tiles[tile_index])
-                prediction = self.model.predict(
-                    np.expand_dims(processed_tile, axis=0), verbose=0
-                )
-                predictions.append(prediction[0])
-                tile_index += 1
+        outputs = list(self.predict_batches(tiles))
+        kept = (i for i, ignore in enumerate(ignore_mask) if not ignore)
+        for i, prediction in zip(kept, np.concatenate(outputs)):
+            predictions[i] = prediction
 
         return predictions
 
+    def predict_batches(self, tiles):
+        """Yield predictions batch by batch, normalising one batch at a time"""
+        for start in range(0, len(tiles), self.batch_size):
+            batch, lookup = self.prepare_batch(np.asarray(tiles[start : start + self.batch_size]))
+            yield self.predict_tiles(batch, lookup)[..., np.newaxis]
+
+    def prepare_batch(self, tiles):
+        """Look tiles up in the tile cache; returns the normalised misses and the cache lookup"""
+        lookup = None
+        if self.tile_cache is not None:
+            with self.timer.stage("tile_cache"):
+                if self.tile_model_id is None:
+                    self.tile_model_id = json.dumps([self.backend, *self.pipelineParams()["model"]])
+                keys = [self.tile_cache.make_key(tile, self.tile_model_id) for tile in tiles]
+                lookup = keys, [self.tile_cache.get(key) for key in keys]
+            tiles = tiles[[prediction is None for prediction in lookup[1]]]
+        batch = self.preprocess_tile(tiles) if len(tiles) else None
+        return batch, lookup
+
+    def predict_tiles(self, batch, lookup):
+        """Predictions for a batch from prepare_batch, merged with the cached tiles"""
+        predictions = []
+        if batch is not None:
+            start = time.perf_counter()
+            with self.timer.stage("inference"):
+                predictions = np.asarray(self.model.predict_on_batch(batch))[..., 0]
+            self.inference_seconds += time.perf_counter() - start
+            self.inferred_tiles += len(batch)
+        if lookup is None:
+            return predictions
+
+        merged = []
+        computed = iter(predictions)
+        for key, prediction in zip(*lookup):
+            if prediction is None:
+                prediction = next(computed)
+                self.tile_cache.put(key, prediction)
+            merged.append(prediction)
+
+        hits = len(merged) - len(predictions)
+        if self.tile_cache_stats is not None:
+            self.tile_cache_stats["hits"] += hits
+            self.tile_cache_stats["misses"] += len(predictions)
+        return np.stack(merged)
+
     def stitch_tiles_with_weights(
         self, tile_predictions, original_size, tile_coordinates, tile_size=(128, 128)
     ):
@@ -180,43 +417,396 @@ class CNNTrackProcessor:
             mask = (mask > 0.5).astype(np.uint8) * 255
 
         # Dilate to close gaps
-        kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (gap_size, gap_size))
-        filled = cv.morphologyEx(mask, cv.MORPH_CLOSE, kernel, iterations=2)
+        with self.timer.stage("gap_close"):
+            filled = self.morphology.close(mask, gap_size, iterations=2)
 
         # Optional: erode slightly to restore original width
-        restore_kernel = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE, (gap_size // 3, gap_size // 3)
-        )
-        filled = cv.erode(filled, restore_kernel, iterations=1)
+        with self.timer.stage("gap_restore"):
+            filled = self.morphology.erode(filled, gap_size // 3, iterations=1)
 
         return filled
 
-    def generate_track_mask_enhanced(self, image_path, tile_size=(128, 128)):
-        """Enhanced multi-pass prediction with more overlap"""
-        original_image = Image.open(image_path).convert("RGB")
-        original_size = original_image.size
-        self.original_image = np.array(original_image)
+    def blend_window(self, tile_size=(128, 128)):
+        """Per-pixel weights of a tile's prediction, or None for flat weights"""
+        if self.blend == "flat":
+            return None
 
-        # Multiple passes with different offsets
-        offsets = [(0, 0), (64, 0), (0, 64), (64, 64), (32, 32)]
-        masks = []
+        def profile(length):
+            position = (np.arange(length) + 0.5) / length
+            if self.blend == "cosine":
+                return np.sin(np.pi * position)
+            return np.exp(-0.5 * ((position - 0.5) / 0.25) ** 2)
+
+        return np.outer(profile(tile_size[1]), profile(tile_size[0])).astype(np.float32)
+
+    def predict_ensemble(self, image, tile_size=(128, 128)):
+        """Average the tile predictions of every offset in ENSEMBLE_OFFSETS"""
+        total, weights = self.ensemble_accumulators(image.shape, tile_size)
+        self.accumulate_offsets(image, tile_size, self.ENSEMBLE_OFFSETS, total, weights)
+        with self.timer.stage("stitching"):
+            return self.normalize_ensemble(total, weights)
+
+    def predict_adaptive(self, image, tile_size=(128, 128)):
+        """Ensemble prediction that only runs the other offsets where the first one is uncertain"""
+        offsets = self.ENSEMBLE_OFFSETS
+        total, weights = self.ensemble_accumulators(image.shape, tile_size)
+        first_tiles = self.accumulate_offsets(image, tile_size, offsets[:1], total, weights)[0]
+        with self.timer.stage("stitching"):
+            first_pass = self.normalize_ensemble(total.copy(), weights, passes=1)
+            estimate, unknown = self.estimate_ensemble(image, first_pass, tile_size)
+            uncertain = np.abs(estimate - self.MASK_THRESHOLD) < self.uncertainty_band
+            uncertain |= unknown
+            del first_pass
+            overlaps_uncertain = self.tiles_overlapping(uncertain, tile_size)
+
+        predicted, skipped = self.accumulate_offsets(image, tile_size, offsets[1:], total, weights, select=overlaps_uncertain)
+        with self.timer.stage("stitching"):
+            mask = self.normalize_ensemble(total, weights)
+            np.copyto(mask, estimate, where=~uncertain)
+
+        self.adaptive_stats = {
+            "tiles": first_tiles + predicted,
+            "skipped_tiles": skipped,
+            "uncertain_fraction": float(uncertain.mean()),
+            "agreement": None,
+        }
+        if self.check_adaptive:
+            # The reference run must not count towards the prefilter stats
+            prefilter_stats = self.prefilter_stats and dict(self.prefilter_stats)
+            full = self.predict_ensemble(image, tile_size) > self.MASK_THRESHOLD
+            self.prefilter_stats = prefilter_stats
+            self.adaptive_stats["agreement"] = float(np.mean(full == (mask > self.MASK_THRESHOLD)))
+        return mask
+
+    def predict_incremental(self, image, tile_size=(128, 128)):
+        """predict_ensemble that only re-infers tiles near what changed since the previous image"""
+        params = self.pipelineParams()
+        previous = self.incremental_state
+        if previous is None or previous["image"].shape != image.shape or previous["params"] != params:
+            mask = self.predict_ensemble(image, tile_size)
+            self.incremental_stats = {
+                "full": True,
+                "changed_pixels": None,
+                "recomputed_fraction": 1.0,
+                "tiles": None,
+            }
+        else:
+            with self.timer.stage("diff"):
+                difference = cv.bitwise_xor(previous["image"], image)
+                changed = (difference[..., 0] | difference[..., 1] | difference[..., 2]) > 0
+                affected = np.zeros(changed.shape, dtype=bool)
+                overlaps_change = self.tiles_overlapping(changed, tile_size)
+                for offset in self.ENSEMBLE_OFFSETS:
+                    xs, ys = self.tile_origins(image.shape, tile_size, offset)
+                    coords = [(int(x), int(y)) for y in ys for x in xs]
+                    if not coords:
+                        continue
+                    for i in np.flatnonzero(overlaps_change(coords)):
+                        x, y = coords[i]
+                        affected[y : y + tile_size[1], x : x + tile_size[0]] = True
+
+            mask = previous["mask"].copy()
+            predicted = 0
+            if affected.any():
+                total, weights = self.ensemble_accumulators(image.shape, tile_size)
+                predicted = self.accumulate_offsets(
+                    image,
+                    tile_size,
+                    self.ENSEMBLE_OFFSETS,
+                    total,
+                    weights,
+                    select=self.tiles_overlapping(affected, tile_size),
+                )[0]
+                with self.timer.stage("stitching"):
+                    recomputed = self.normalize_ensemble(total, weights)
+                    np.copyto(mask, recomputed, where=affected)
+            self.incremental_stats = {
+                "full": False,
+                "changed_pixels": int(changed.sum()),
+                "recomputed_fraction": float(affected.mean()),
+                "tiles": predicted,
+            }
 
+        self.incremental_state = {"image": image, "mask": mask.copy(), "params": params}
+        return mask
+
+    def tiles_overlapping(self, region, tile_size=(128, 128)):
+        """Tile selector for accumulate_offsets: tiles holding a pixel of ``region``"""
+        height, width = region.shape
+        # Region pixel counts of any rectangle from an integral image
+        counts = cv.integral(region.astype(np.uint8))
+
+        def select(coords):
+            x, y = np.asarray(coords).T
+            x2 = np.minimum(x + tile_size[0], width)
+            y2 = np.minimum(y + tile_size[1], height)
+            inside = counts[y2, x2] - counts[y, x2] - counts[y2, x] + counts[y, x]
+            return inside > 0
+
+        return select
+
+    def estimate_ensemble(self, image, prediction, tile_size=(128, 128)):
+        """Ensemble estimate from the first offset's prediction, and where other offsets add tiles"""
+        height, width = image.shape[:2]
+        tile_w, tile_h = tile_size
+        window = self.blend_window(tile_size)
+        if window is None:
+            window = np.ones((tile_h, tile_w), dtype=np.float32)
+        total, weights = self.ensemble_accumulators(image.shape, tile_size)
+        # Pixels in non-black tiles of the first offset and of any offset
+        known = np.zeros((height, width), dtype=bool)
+        predicted = np.zeros((height, width), dtype=bool)
+
+        for offset in self.ENSEMBLE_OFFSETS:
+            tiles, coords, ignore = self.tile_image_with_offset(image, tile_size, offset, self.BLACK_THRESHOLD)
+            _, ignore = self.prefilter_tiles(tiles, ignore, count=False)
+            for (x, y), ignored in zip(coords, ignore):
+                h = min(tile_h, height - y)
+                w = min(tile_w, width - x)
+                if weights is not None:
+                    weights[y : y + h, x : x + w] += window[:h, :w]
+                if not ignored:
+                    total[y : y + h, x : x + w] += prediction[y : y + h, x : x + w] * window[:h, :w]
+                    predicted[y : y + h, x : x + w] = True
+            if offset == self.ENSEMBLE_OFFSETS[0]:
+                known[:] = predicted
+
+        return self.normalize_ensemble(total, weights), predicted & ~known
+
+    def prefilter_tiles(self, tiles, ignore_mask, count=True):
+        """Drop the tiles the prefilter rules out, marking them as ignored"""
+        if self.prefilter is None or len(tiles) == 0:
+            return tiles, ignore_mask
+
+        with self.timer.stage("prefilter"):
+            skip = self.prefilter.skip(tiles)
+            ignore_mask = list(ignore_mask)
+            kept = [i for i, ignored in enumerate(ignore_mask) if not ignored]
+            for i in np.flatnonzero(skip):
+                ignore_mask[kept[i]] = True
+            if count:
+                self.prefilter_stats["tiles"] += len(tiles)
+                self.prefilter_stats["skipped_tiles"] += int(skip.sum())
+            return tiles[~skip], ignore_mask
+
+    def ensemble_accumulators(self, image_shape, tile_size=(128, 128)):
+        """Zeroed prediction sum and, for a blend window, weight sum"""
+        dtype = np.float16 if self.float16 else np.float32
+        total = np.zeros(image_shape[:2], dtype=dtype)
+        if self.blend_window(tile_size) is None:
+            return total, None
+        return total, np.zeros(image_shape[:2], dtype=dtype)
+
+    def normalize_ensemble(self, total, weights, passes=None):
+        """Turn the accumulated sums into probabilities, in place"""
+        if weights is None:
+            # Tiles of one offset never overlap and every offset counts
+            # as zero where it has no tile, so the ensemble mean of the
+            # per-offset masks is the sum over the number of offsets
+            total /= passes or len(self.ENSEMBLE_OFFSETS)
+        else:
+            np.divide(total, weights, out=total, where=weights > 0)
+        return total
+
+    def accumulate_offsets(self, image, tile_size, offsets, total, weights, select=None):
+        """Add the tile predictions of ``offsets`` to the ensemble sums; returns tiles predicted and skipped"""
+        counts = {"predicted": 0, "skipped": 0}
+        # Tile windows placed by more than one offset are predicted once
+        origins = Counter()
         for offset in offsets:
-            tiles, coords, ignore = self.tile_image_with_offset(
-                original_image, tile_size, offset=offset
-            )
-            predictions = self.predict_on_tiles(tiles, ignore)
-            mask = self.stitch_tiles_with_weights(
-                predictions, original_size, coords, tile_size
-            )
-            masks.append(mask)
+            xs, ys = self.tile_origins(image.shape, tile_size, offset)
+            origins.update((int(x), int(y)) for y in ys for x in xs)
 
-        # Ensemble averaging
-        final_mask = np.mean(masks, axis=0)
-        binary_mask = (final_mask > 0.2).astype(np.uint8) * 255
+        produce = partial(self.offset_items, image, tile_size, offsets, origins, weights is not None, select, counts)
+        stitch = partial(self.stitch_item, total, weights, self.blend_window(tile_size), origins, {})
+        if self.pipeline:
+            run_pipelined(produce, self.infer_item, stitch, self.PIPELINE_DEPTH)
+        else:
+            for item in produce():
+                stitch(self.infer_item(item))
+
+        return counts["predicted"], counts["skipped"]
+
+    def choose_tiles(self, kept, select, claimed, origins, counts):
+        """Split an offset's kept tiles into reused shared windows and indices to predict"""
+        chosen = range(len(kept))
+        if select is not None and kept:
+            chosen = np.flatnonzero(select(kept))
+            counts["skipped"] += len(kept) - len(chosen)
+        reused = [kept[i] for i in chosen if kept[i] in claimed]
+        pending = [i for i in chosen if kept[i] not in claimed]
+        claimed.update(kept[i] for i in pending if origins[kept[i]] > 1)
+        counts["predicted"] += len(pending)
+        return reused, pending
+
+    def offset_items(self, image, tile_size, offsets, origins, weighted, select, counts):
+        """Producer of accumulate_offsets: weights, reused windows and batches per offset"""
+        claimed = set()
+        for offset in offsets:
+            with self.timer.stage("tiling"):
+                tiles, coords, ignore = self.tile_image_with_offset(image, tile_size, offset, self.BLACK_THRESHOLD)
+            tiles, ignore = self.prefilter_tiles(tiles, ignore)
+            with self.timer.stage("tiling"):
+                kept = [xy for xy, ignored in zip(coords, ignore) if not ignored]
+                reused, pending = self.choose_tiles(kept, select, claimed, origins, counts)
+                if len(pending) < len(kept):
+                    tiles = tiles[pending]
+
+            # Ignored tiles predict zero: they only add to the weights
+            if weighted:
+                yield "weights", coords
+            if reused:
+                yield "reuse", reused
+            for start in range(0, len(pending), self.batch_size):
+                with self.timer.stage("tiling"):
+                    chunk = np.asarray(tiles[start : start + self.batch_size])
+                    xys = [kept[i] for i in pending[start : start + len(chunk)]]
+                    batch, lookup = self.prepare_batch(chunk)
+                yield "batch", (batch, lookup, xys)
+
+    def infer_item(self, item):
+        kind, payload = item
+        if kind != "batch":
+            return item
+        batch, lookup, xys = payload
+        return "predictions", (self.predict_tiles(batch, lookup), xys)
+
+    def stitch_item(self, total, weights, window, origins, shared, item):
+        """Consumer of accumulate_offsets: add one produced item to the sums"""
+        kind, payload = item
+        with self.timer.stage("stitching"):
+            if kind == "weights":
+                for x, y in payload:
+                    self.add_tile(weights, x, y, window)
+            elif kind == "reuse":
+                for x, y in payload:
+                    self.add_tile(total, x, y, shared[x, y], window)
+            else:
+                predictions, xys = payload
+                for (x, y), prediction in zip(xys, predictions):
+                    self.add_tile(total, x, y, prediction, window)
+                    if origins[x, y] > 1:
+                        shared[x, y] = prediction
+
+    def add_tile(self, total, x, y, values, window=None):
+        """Add a tile's values at (x, y), weighted by the blend window, clipped to the image"""
+        target = total[y : y + values.shape[0], x : x + values.shape[1]]
+        h, w = target.shape
+        if window is None:
+            target += values[:h, :w]
+        else:
+            target += values[:h, :w] * window[:h, :w]
+
+    def fullyConvolutionalModel(self):
+        """The model rebuilt to accept inputs of any size divisible by 16"""
+        return get_model(self.model_path, fully_convolutional=True)
+
+    def predict_large_windows(self, image):
+        """Predict the image in large windows with a halo of context"""
+        height, width = image.shape[:2]
+        core_h = min(self.window_size, -(-height // 16) * 16)
+        core_w = min(self.window_size, -(-width // 16) * 16)
+        halo = self.window_halo
+        rows, cols = -(-height // core_h), -(-width // core_w)
+        cell = 128
+        cell_rows, cell_cols = -(-height // cell), -(-width // cell)
+
+        with self.timer.stage("tiling"):
+            padded_h = max(rows * core_h, cell_rows * cell) + 2 * halo
+            padded_w = max(cols * core_w, cell_cols * cell) + 2 * halo
+            padded = np.zeros((padded_h, padded_w, 3), np.uint8)
+            padded[halo : halo + height, halo : halo + width] = image
+
+            # Cells the tile path would ignore at offset (0, 0)
+            cells = padded[halo : halo + cell_rows * cell, halo : halo + cell_cols * cell]
+            black = (cells[..., 0] | cells[..., 1] | cells[..., 2]) == 0
+            black_pixels = black.reshape(cell_rows, cell, cell_cols, cell).sum(axis=(1, 3))
+            kept_cells = black_pixels / (cell * cell) < self.BLACK_THRESHOLD
+        if self.prefilter is not None:
+            with self.timer.stage("prefilter"):
+                grid = cells.reshape(cell_rows, cell, cell_cols, cell, 3).swapaxes(1, 2)
+                skip = self.prefilter.skip(grid[kept_cells])
+                self.prefilter_stats["tiles"] += len(skip)
+                self.prefilter_stats["skipped_tiles"] += int(skip.sum())
+                kept_cells[kept_cells] = ~skip
+        with self.timer.stage("tiling"):
+            keep = np.zeros((rows * core_h, cols * core_w), dtype=bool)
+            keep[:height, :width] = np.repeat(np.repeat(kept_cells, cell, axis=0), cell, axis=1)[:height, :width]
+
+            run = keep.reshape(rows, core_h, cols, core_w).any(axis=(1, 3))
+            windows = list(zip(*np.nonzero(run)))
+
+        model = self.fullyConvolutionalModel()
+        # Same number of pixels per model call as a batch of 128 px tiles
+        window_pixels = (core_h + 2 * halo) * (core_w + 2 * halo)
+        per_call = max(1, self.batch_size * 128 * 128 // window_pixels)
+
+        mask = np.zeros((rows * core_h, cols * core_w), dtype=np.float32)
+
+        def produce():
+            for start in range(0, len(windows), per_call):
+                chunk = windows[start : start + per_call]
+                with self.timer.stage("tiling"):
+                    batch = self.preprocess_tile(
+                        np.stack(
+                            [
+                                padded[
+                                    row * core_h : (row + 1) * core_h + 2 * halo,
+                                    col * core_w : (col + 1) * core_w + 2 * halo,
+                                ]
+                                for row, col in chunk
+                            ]
+                        )
+                    )
+                yield chunk, batch
+
+        def infer(item):
+            chunk, batch = item
+            with self.timer.stage("inference"):
+                return chunk, np.asarray(model.predict_on_batch(batch))
+
+        def stitch(item):
+            chunk, predictions = item
+            with self.timer.stage("stitching"):
+                for (row, col), prediction in zip(chunk, predictions):
+                    mask[
+                        row * core_h : (row + 1) * core_h,
+                        col * core_w : (col + 1) * core_w,
+                    ] = prediction[halo : halo + core_h, halo : halo + core_w, 0]
+
+        if self.pipeline:
+            run_pipelined(produce, infer, stitch, self.PIPELINE_DEPTH)
+        else:
+            for item in produce():
+                stitch(infer(item))
 
-        binary_mask = remove_small_regions(binary_mask, min_area=20000)
-        binary_mask = self.fill_track_gaps(binary_mask, gap_size=10)
+        mask *= keep
+        return mask[:height, :width]
+
+    def generate_track_mask_enhanced(self, image_path, tile_size=(128, 128)):
+        """Enhanced multi-pass prediction with more overlap"""
+        with self.timer.stage("load"):
+            original_image = Image.open(image_path).convert("RGB")
+            self.original_image = np.array(original_image)
+
+        if self.prefilter is not None:
+            self.prefilter_stats = {"tiles": 0, "skipped_tiles": 0}
+        if self.inference == "window":
+            final_mask = self.predict_large_windows(self.original_image)
+        elif self.inference == "adaptive":
+            final_mask = self.predict_adaptive(self.original_image, tile_size)
+        elif self.incremental:
+            final_mask = self.predict_incremental(self.original_image, tile_size)
+        else:
+            final_mask = self.predict_ensemble(self.original_image, tile_size)
+
+        with self.timer.stage("threshold"):
+            binary_mask = (final_mask > self.MASK_THRESHOLD).astype(np.uint8) * 255
+
+        with self.timer.stage("cleanup"):
+            with self.timer.stage("small_regions"):
+                binary_mask = remove_small_regions(binary_mask, min_area=self.MIN_REGION_AREA)
+            binary_mask = self.fill_track_gaps(binary_mask, gap_size=self.GAP_SIZE)
 
         self.track_mask = binary_mask
 
@@ -262,15 +852,11 @@ class CNNTrackProcessor:
         binary_mask = remove_small_regions(binary_mask, min_area=5000)
 
         # Morphological smoothing
-        kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (7, 7))
-        binary_mask = cv.morphologyEx(binary_mask, cv.MORPH_CLOSE, kernel, iterations=2)
-        binary_mask = cv.morphologyEx(binary_mask, cv.MORPH_OPEN, kernel, iterations=1)
+        binary_mask = self.morphology.close(binary_mask, 7, iterations=2)
+        binary_mask = self.morphology.open(binary_mask, 7, iterations=1)
 
         # Gap filling
-        gap_kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (30, 30))
-        binary_mask = cv.morphologyEx(
-            binary_mask, cv.MORPH_CLOSE, gap_kernel, iterations=2
-        )
+        binary_mask = self.morphology.close(binary_mask, 30, iterations=2)
 
         self.track_mask = binary_mask
         return self.track_mask
@@ -300,8 +886,8 @@ class CNNTrackProcessor:
 
         # Fallback: approximate with erosion
         if inner_boundary is None:
-            kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (20, 20))
-            eroded = cv.erode(mask, kernel, iterations=3)
+            with self.timer.stage("inner_erosion"):
+                eroded = self.morphology.erode(mask, 20, iterations=3)
             inner_contours, _ = cv.findContours(
                 eroded, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE
             )
@@ -318,93 +904,361 @@ class CNNTrackProcessor:
 
     def processImageForCSharp(self, img_path):
         """Main processing function that matches the original interface"""
+        self.timer.reset()
+        if self.tile_cache is not None:
+            self.tile_cache_stats = {"hits": 0, "misses": 0}
+        try:
+            # Picks up a model file replaced since the last image
+            self.model = get_model(self.model_path)
+            self.tile_model_id = None
+            if self.result_cache is not None:
+                result = self.result_cache.fetch(img_path, self.pipelineParams(), self._processImage)
+            else:
+                result = self._processImage(img_path)
+        except Exception as e:
+            result = failure_result(str(e))
+
+        if self.timer.enabled:
+            timings = self.timer.summary()
+            if self.tile_cache is not None:
+                timings["tile_cache"] = self.tileCacheSummary()
+            result = dict(result, timings=timings)
+        return result
+
+    def tileCacheSummary(self):
+        """This image's tile cache hits, hit rate and estimated model time saved"""
+        stats = dict(self.tile_cache_stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        # Unknown until this processor has timed the model on some tiles
+        stats["saved_ms"] = None
+        if self.inferred_tiles:
+            seconds_per_tile = self.inference_seconds / self.inferred_tiles
+            stats["saved_ms"] = stats["hits"] * seconds_per_tile * 1000.0
+        return stats
+
+    def _processImage(self, img_path):
         try:
             mask = self.generate_track_mask_enhanced(img_path)
             if mask is None:
-                return {
-                    "success": False,
-                    "outer_boundary": [],
-                    "inner_boundary": [],
-                    "error": "Failed to generate track mask",
-                }
-
-            boundaries = self.detectBoundaries(mask)
+                return failure_result("Failed to generate track mask")
+
+            with self.timer.stage("contours"):
+                boundaries = self.detectBoundaries(mask)
             if boundaries is None:
-                return {
-                    "success": False,
-                    "outer_boundary": [],
-                    "inner_boundary": [],
-                    "error": "Failed to detect track boundaries",
-                }
+                return failure_result("Failed to detect track boundaries")
 
             outer_coords = []
             inner_coords = []
 
-            if boundaries["outer"] is not None:
-                outer_coords = self.resampleContour(
-                    boundaries["outer"], NUM_EDGE_POINTS
-                )
+            with self.timer.stage("resampling"):
+                if boundaries["outer"] is not None:
+                    outer_coords = self.resampleContour(boundaries["outer"], NUM_EDGE_POINTS)
 
-            if boundaries["inner"] is not None:
-                inner_coords = self.resampleContour(
-                    boundaries["inner"], NUM_EDGE_POINTS
-                )
+                if boundaries["inner"] is not None:
+                    inner_coords = self.resampleContour(boundaries["inner"], NUM_EDGE_POINTS)
 
-            return {
+            result = {
                 "success": True,
                 "outer_boundary": outer_coords,
                 "inner_boundary": inner_coords,
                 "error": None,
             }
+            if self.inference == "adaptive":
+                result["adaptive"] = self.adaptive_stats
+            if self.prefilter is not None:
+                result["prefilter"] = self.prefilter_stats
+            if self.incremental:
+                result["incremental"] = self.incremental_stats
+            return result
 
         except Exception as e:
-            return {
-                "success": False,
-                "outer_boundary": [],
-                "inner_boundary": [],
-                "error": str(e),
+            return failure_result(str(e))
+
+
+def thread_budgets(cores):
+    """(workers, TensorFlow threads per worker) splits of ``cores``"""
+    splits = []
+    jobs = 1
+    while jobs < cores:
+        splits.append((jobs, cores // jobs))
+        jobs *= 2
+    splits.append((cores, 1))
+    return splits
+
+
+def run_cnn_batch(images, output_dir, processor_options, jobs, threads, **kwargs):
+    """run_batch with spawned CNNTrackProcessor workers limited to ``threads`` each"""
+    inter_op_threads = kwargs.pop("inter_op_threads", 1)
+    return run_batch(
+        images,
+        output_dir,
+        jobs,
+        processor_options=processor_options,
+        processor_factory=CNNTrackProcessor,
+        worker_setup=partial(set_thread_budget, threads, inter_op_threads),
+        mp_context=get_context("spawn"),
+        **kwargs,
+    )
+
+
+def calibrate_batch(images, processor_options, cores=None, sample_images=8, inter_op_threads=1):
+    """Time every thread_budgets split on a sample of images; returns the fastest jobs, threads and the report"""
+    cores = cores or os.cpu_count() or 1
+    # Cached results or tiles would let later splits reuse the work of earlier ones
+    options = dict(processor_options, result_cache=None, tile_cache=None)
+    report = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for jobs, threads in thread_budgets(cores):
+            sample = images[: max(sample_images, 2 * jobs)]
+            summary = run_cnn_batch(
+                sample,
+                output_dir,
+                options,
+                jobs,
+                threads,
+                inter_op_threads=inter_op_threads,
+                verbose=False,
+            )
+            mean = summary["mean_image_seconds"]
+            entry = {
+                "jobs": summary["jobs"],
+                "threads": threads,
+                "images": summary["images"],
+                "mean_image_seconds": mean,
+                "images_per_second": summary["jobs"] / mean if mean else 0.0,
             }
-
-
-def write_result_to_file(result, output_file):
-    """Write result to file instead of printing to stdout"""
-    try:
-        with open(output_file, "w") as f:
-            json.dump(result, f, separators=(",", ":"))
-        return True
-    except Exception as e:
-        print(f"Error writing to file: {e}", file=sys.stderr)
-        return False
+            report.append(entry)
+            print(f"calibration: {entry['jobs']} workers x {threads} threads: {entry['images_per_second']:.2f} images/s")
+
+    best = max(report, key=lambda entry: entry["images_per_second"])
+    return best["jobs"], best["threads"], report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract track boundaries from a track image with the CNN model")
+    parser.add_argument("img_path", nargs="?", help="Path to the track image")
+    parser.add_argument(
+        "output_file",
+        nargs="?",
+        help="Write the result here instead of stdout (.bin for EdgeData binary)",
+    )
+    parser.add_argument("--model", default="best_modelv2.keras", help="Path to the Keras model")
+    parser.add_argument(
+        "--backend",
+        choices=CNNTrackProcessor.BACKENDS,
+        help="Inference backend (default: tflite for .tflite models, else keras)",
+    )
+    add_service_arguments(parser, "Batch worker processes, each with its own model (default: 1)")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="TensorFlow intra-op threads per batch worker (default: cores / jobs)",
+    )
+    parser.add_argument(
+        "--inter-op-threads",
+        type=int,
+        default=1,
+        help="TensorFlow inter-op threads per batch worker (default: 1)",
+    )
+    parser.add_argument(
+        "--calibrate",
+        action="store_true",
+        help="Time workers x threads splits on a sample and use the fastest",
+    )
+    parser.add_argument(
+        "--calibration-images",
+        type=int,
+        default=8,
+        help="Images per calibration run (default: 8, at least 2 per worker)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="In worker mode, re-infer only the tiles around pixels that changed since the previous image",
+    )
+    parser.add_argument(
+        "--tile-cache-mb",
+        type=int,
+        default=0,
+        help="Keep up to this many MB of per-tile predictions in memory (default: off)",
+    )
+    parser.add_argument(
+        "--tile-cache-dir",
+        help="Also store per-tile predictions in this directory",
+    )
+    parser.add_argument(
+        "--tile-cache-disk-mb",
+        type=int,
+        default=DEFAULT_TILE_DISK_BYTES // (1024 * 1024),
+        help="Evict least recently used tiles from --tile-cache-dir beyond this size",
+    )
+    parser.add_argument(
+        "--inference",
+        choices=CNNTrackProcessor.INFERENCE_MODES,
+        default="tiles",
+        help="Offset ensemble of 128 px tiles, one pass of large windows, "
+        "or the ensemble refined only where the first offset is uncertain",
+    )
+    parser.add_argument(
+        "--uncertainty-band",
+        type=float,
+        default=CNNTrackProcessor.UNCERTAINTY_BAND,
+        help="Distance from the mask threshold that counts as uncertain in "
+        f"--inference adaptive (default: {CNNTrackProcessor.UNCERTAINTY_BAND})",
+    )
+    parser.add_argument(
+        "--check-adaptive",
+        action="store_true",
+        help="Also run the full ensemble and report the adaptive mask's agreement",
+    )
+    parser.add_argument(
+        "--window-size",
+        type=int,
+        default=CNNTrackProcessor.WINDOW_SIZE,
+        help=f"Window size for --inference window (default: {CNNTrackProcessor.WINDOW_SIZE})",
+    )
+    parser.add_argument(
+        "--window-halo",
+        type=int,
+        default=CNNTrackProcessor.WINDOW_HALO,
+        help=f"Context pixels around each window (default: {CNNTrackProcessor.WINDOW_HALO})",
+    )
+    parser.add_argument(
+        "--blend",
+        choices=CNNTrackProcessor.BLEND_WINDOWS,
+        default="flat",
+        help="Weighting of overlapping tile predictions (default: flat)",
+    )
+    parser.add_argument(
+        "--float16",
+        action="store_true",
+        help="Accumulate the ensemble in float16 to halve its memory",
+    )
+    parser.add_argument(
+        "--prefilter",
+        metavar="PATH",
+        help="Skip tiles ruled out by a TilePrefilter.py calibration file",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Tile and stitch on separate threads while the model predicts",
+    )
+    parser.add_argument(
+        "--morphology",
+        dest="morphology_engine",
+        choices=MORPHOLOGY_ENGINES,
+        default="opencv",
+        help="Erode/dilate with OpenCV kernels, distance transforms, or "
+        "distance transforms for large kernels only (default: opencv)",
+    )
+    parser.add_argument(
+        "--morphology-downsample",
+        type=int,
+        default=1,
+        help="Run cleanup morphology on a mask shrunk by this factor",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=CNNTrackProcessor.BATCH_SIZE,
+        help=f"Tiles per model call (default: {CNNTrackProcessor.BATCH_SIZE})",
+    )
+    return parser.parse_args(argv)
 
 
 def main():
-    if len(sys.argv) < 2:
-        result = {
-            "success": False,
-            "outer_boundary": [],
-            "inner_boundary": [],
-            "error": "No image path provided",
-        }
-        if len(sys.argv) >= 3:
-            write_result_to_file(result, sys.argv[2])
-        else:
-            print(json.dumps(result, separators=(",", ":")))
+    args = parse_args()
+
+    if args.img_path is None and not (args.worker or args.batch):
+        result = failure_result("No image path provided")
+        print(result_to_json(result))
         sys.exit(1)
 
-    img_path = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) >= 3 else None
+    img_path = args.img_path
+    output_file = args.output_file
+
+    result_cache = None
+    if args.cache_dir:
+        result_cache = ResultCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+
+    processor_options = {
+        "model_path": args.model,
+        "result_cache": result_cache,
+        "instrument": args.timings or bool(args.trace),
+        "batch_size": args.batch_size,
+        "inference": args.inference,
+        "window_size": args.window_size,
+        "window_halo": args.window_halo,
+        "backend": args.backend,
+        "blend": args.blend,
+        "float16": args.float16,
+        "uncertainty_band": args.uncertainty_band,
+        "check_adaptive": args.check_adaptive,
+        "prefilter": args.prefilter,
+        "pipeline": args.pipeline,
+        "morphology_engine": args.morphology_engine,
+        "morphology_downsample": args.morphology_downsample,
+        "incremental": args.incremental,
+    }
+    if args.tile_cache_mb or args.tile_cache_dir:
+        tile_cache_bytes = args.tile_cache_mb * 1024 * 1024
+        processor_options["tile_cache"] = TileCache(
+            tile_cache_bytes or DEFAULT_TILE_CACHE_BYTES,
+            args.tile_cache_dir,
+            args.tile_cache_disk_mb * 1024 * 1024,
+        )
+
+    if args.batch:
+        images = collect_images(args.batch)
+        cores = os.cpu_count() or 1
+        jobs = args.jobs or 1
+        threads = args.threads or max(1, cores // jobs)
+        calibration = None
+        if args.calibrate and images:
+            jobs, threads, calibration = calibrate_batch(
+                images,
+                processor_options,
+                cores,
+                args.calibration_images,
+                args.inter_op_threads,
+            )
+        summary = run_cnn_batch(
+            images,
+            args.output_dir,
+            processor_options,
+            jobs,
+            threads,
+            inter_op_threads=args.inter_op_threads,
+        )
+        summary["threads_per_worker"] = threads
+        summary["calibration"] = calibration
+        with open(os.path.join(args.output_dir, BATCH_SUMMARY_NAME + ".json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        sys.exit(0 if summary["images"] and not summary["failed"] else 1)
+
+    processor = CNNTrackProcessor(**processor_options)
+    if args.worker:
+        run_worker(processor)
+        sys.exit(0)
 
-    processor = CNNTrackProcessor()
     result = processor.processImageForCSharp(img_path)
 
-    if output_file:
-        if write_result_to_file(result, output_file):
-            sys.exit(0 if result["success"] else 1)
+    with processor.timer.stage("serialization"):
+        if output_file:
+            written = write_result(result, output_file)
         else:
-            sys.exit(2)
-    else:
-        print(json.dumps(result, separators=(",", ":")))
-        sys.exit(0 if result["success"] else 1)
+            print(result_to_json(result))
+            written = True
+
+    if args.trace:
+        processor.timer.write_chrome_trace(args.trace)
+
+    if not written:
+        sys.exit(2)
+    sys.exit(0 if result["success"] else 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from ModelRegistry import TFLITE_EXTENSION, TFLiteModel
+from PIL import Image
+
+QUANTIZATIONS = ("none", "dynamic", "int8")
+TILE_SIZE = 128
+
+
+def load_tiles(image_dir, max_tiles=None):
+    """Training-layout ``*_sat.jpg`` images as normalised 128x128 float32 tiles"""
+    paths = sorted(glob.glob(os.path.join(image_dir, "*_sat.jpg")))
+    if max_tiles:
+        paths = paths[:max_tiles]
+
+    tiles = np.empty((len(paths), TILE_SIZE, TILE_SIZE, 3), dtype=np.float32)
+    for i, path in enumerate(paths):
+        img = Image.open(path).convert("RGB").resize((TILE_SIZE, TILE_SIZE))
+        tiles[i] = np.asarray(img, dtype=np.float32) / 255.0
+    return tiles
+
+
+def export_tflite(model, output_path, quantization="none", calibration_tiles=None):
+    """Convert a Keras model to TensorFlow Lite.
+
+    ``dynamic`` stores the weights as int8 and quantizes activations on the
+    fly; ``int8`` also quantizes activations, with ranges calibrated on
+    ``calibration_tiles``. Inputs and outputs stay float32 in every mode, so
+    exports are drop-in replacements for the Keras model.
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "int8":
+        if calibration_tiles is None or len(calibration_tiles) == 0:
+            raise ValueError("int8 quantization needs calibration tiles")
+
+        def representative_dataset():
+            for tile in calibration_tiles:
+                yield [tile[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    return output_path
+
+
+def measure_throughput(model, tiles, batch_size=32, seconds=3.0):
+    """Tiles per second of predict_on_batch, after one warm-up batch"""
+    batch = tiles[:batch_size]
+    model.predict_on_batch(batch)
+
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        model.predict_on_batch(batch)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return runs * len(batch) / elapsed
+
+
+def evaluate(model, test_dir, output_file, max_samples=None):
+    """F1/IoU from TrackCNN.calculate_f1_score, or None without test data"""
+    if not test_dir or not glob.glob(os.path.join(test_dir, "*_sat.jpg")):
+        return None
+
+    from TrackCNN import calculate_f1_score
+
+    return calculate_f1_score(model, test_dir, test_dir, output_file=output_file, max_samples=max_samples)
+
+
+def export_model(
+    model_path,
+    output_dir,
+    quantizations=QUANTIZATIONS,
+    calibration_dir="data/train",
+    calibration_samples=200,
+    test_dir="data/test",
+    test_samples=None,
+    benchmark_seconds=3.0,
+):
+    """Export a Keras model to TFLite in each quantization and compare them.
+
+    Every export is timed on the same tiles as the Keras model and, when
+    ``test_dir`` holds test images, evaluated with the F1/IoU code used for
+    training. Writes ``export_report.json`` to ``output_dir`` and returns
+    the report dict.
+    """
+    from ModelRegistry import get_model
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = get_model(model_path)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    metrics_file = os.path.join(output_dir, "export_metrics.txt")
+
+    calibration_tiles = load_tiles(calibration_dir, calibration_samples)
+    # Timing only needs realistic shapes; fall back to noise without data
+    timing_tiles = calibration_tiles
+    if len(timing_tiles) < 32:
+        rng = np.random.default_rng(0)
+        timing_tiles = rng.random((32, TILE_SIZE, TILE_SIZE, 3), dtype=np.float32)
+
+    keras_entry = {
+        "path": model_path,
+        "size_bytes": os.path.getsize(model_path),
+        "tiles_per_second": measure_throughput(model, timing_tiles, seconds=benchmark_seconds),
+        "metrics": evaluate(model, test_dir, metrics_file, test_samples),
+    }
+    report = {
+        "model": model_path,
+        "calibration_tiles": len(calibration_tiles),
+        "keras": keras_entry,
+        "exports": [],
+    }
+
+    for quantization in quantizations:
+        suffix = "" if quantization == "none" else f"_{quantization}"
+        output_path = os.path.join(output_dir, f"{stem}{suffix}{TFLITE_EXTENSION}")
+        entry = {"quantization": quantization, "path": output_path, "error": None}
+        try:
+            export_tflite(model, output_path, quantization, calibration_tiles)
+        except Exception as e:
+            entry["error"] = str(e)
+            report["exports"].append(entry)
+            continue
+
+        exported = TFLiteModel(output_path)
+        entry["size_bytes"] = os.path.getsize(output_path)
+        entry["tiles_per_second"] = measure_throughput(exported, timing_tiles, seconds=benchmark_seconds)
+        entry["speedup"] = entry["tiles_per_second"] / keras_entry["tiles_per_second"]
+        entry["metrics"] = evaluate(exported, test_dir, metrics_file, test_samples)
+
+        # Agreement with the Keras model on the timing tiles, independent of labels
+        expected = np.asarray(model.predict_on_batch(timing_tiles[:32])) > 0.5
+        predicted = exported.predict_on_batch(timing_tiles[:32]) > 0.5
+        union = np.logical_or(expected, predicted).sum()
+        entry["iou_vs_keras"] = float(np.logical_and(expected, predicted).sum() / union) if union else 1.0
+
+        if entry["metrics"] and keras_entry["metrics"]:
+            entry["f1_delta"] = entry["metrics"]["f1"] - keras_entry["metrics"]["f1"]
+            entry["iou_delta"] = entry["metrics"]["mean_iou"] - keras_entry["metrics"]["mean_iou"]
+        report["exports"].append(entry)
+
+    with open(os.path.join(output_dir, "export_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def print_report(report):
+    keras_entry = report["keras"]
+    keras_metrics = keras_entry["metrics"]
+    print(
+        f"\n{'model':<34}{'size MB':>9}{'tiles/s':>10}{'speedup':>9}"
+        f"{'F1':>8}{'IoU':>8}{'dF1':>9}{'dIoU':>9}{'IoU vs keras':>14}"
+    )
+
+    def metric_columns(metrics, entry):
+        if not metrics:
+            return f"{'-':>8}{'-':>8}{'-':>9}{'-':>9}"
+        return (
+            f"{metrics['f1']:>8.4f}{metrics['mean_iou']:>8.4f}"
+            f"{entry.get('f1_delta', 0.0):>+9.4f}{entry.get('iou_delta', 0.0):>+9.4f}"
+        )
+
+    print(
+        f"{os.path.basename(keras_entry['path']):<34}"
+        f"{keras_entry['size_bytes'] / 1e6:>9.2f}"
+        f"{keras_entry['tiles_per_second']:>10.1f}{1.0:>9.2f}"
+        f"{metric_columns(keras_metrics, {})}{'-':>14}"
+    )
+    for entry in report["exports"]:
+        name = os.path.basename(entry["path"])
+        if entry["error"]:
+            print(f"{name:<34} failed: {entry['error']}")
+            continue
+        print(
+            f"{name:<34}{entry['size_bytes'] / 1e6:>9.2f}"
+            f"{entry['tiles_per_second']:>10.1f}{entry['speedup']:>9.2f}"
+            f"{metric_columns(entry['metrics'], entry)}"
+            f"{entry['iou_vs_keras']:>14.4f}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the track CNN to TensorFlow Lite and compare the exports")
+    parser.add_argument("model_path", help="Keras model to export")
+    parser.add_argument("--output-dir", default="exported", help="Directory for exports and report")
+    parser.add_argument(
+        "--quantization",
+        nargs="+",
+        choices=QUANTIZATIONS,
+        default=list(QUANTIZATIONS),
+        help="Quantization modes to export (default: all)",
+    )
+    parser.add_argument(
+        "--calibration-dir",
+        default="data/train",
+        help="Training images (*_sat.jpg) used to calibrate int8 (default: data/train)",
+    )
+    parser.add_argument(
+        "--calibration-samples",
+        type=int,
+        default=200,
+        help="Number of calibration tiles (default: 200)",
+    )
+    parser.add_argument(
+        "--test-dir",
+        default="data/test",
+        help="Test images and masks for F1/IoU (default: data/test)",
+    )
+    parser.add_argument(
+        "--test-samples",
+        type=int,
+        default=None,
+        help="Limit the number of test images evaluated",
+    )
+    parser.add_argument(
+        "--benchmark-seconds",
+        type=float,
+        default=3.0,
+        help="Time spent measuring each model's throughput (default: 3)",
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    report = export_model(
+        args.model_path,
+        args.output_dir,
+        args.quantization,
+        args.calibration_dir,
+        args.calibration_samples,
+        args.test_dir,
+        args.test_samples,
+        args.benchmark_seconds,
+    )
+    print_report(report)
+    print(f"\nReport written to {os.path.join(args.output_dir, 'export_report.json')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import threading
+
+import numpy as np
+
+# Size used for dimensions the model leaves open when warming it up
+WARMUP_TILE = 128
+TFLITE_EXTENSION = ".tflite"
+# Intra-op threads chosen by set_thread_budget, None for all cores
+_intra_op_threads = None
+
+
+def tflite_interpreter_class():
+    """LiteRT's interpreter, or the deprecated tf.lite one when ai-edge-litert is not installed"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+
+        return tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """TensorFlow Lite interpreter behind the subset of the Keras model API
+    that the processors use (``input_shape``, ``predict_on_batch``, ``predict``)"""
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        interpreter_class = tflite_interpreter_class()
+        self.interpreter = interpreter_class(model_path=model_path, num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.input_shape = (None, *self.input_detail["shape"][1:])
+        self.batch_size = int(self.input_detail["shape"][0])
+
+    def predict_on_batch(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if len(batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_detail["index"], batch.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(batch)
+        self.interpreter.set_tensor(self.input_detail["index"], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+    def predict(self, batch, batch_size=32, verbose=0):
+        return np.concatenate([self.predict_on_batch(batch[i : i + batch_size]) for i in range(0, len(batch), batch_size)])
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded Keras and TensorFlow Lite models.
+
+    Models are keyed by absolute path, file size and modification time, so
+    each file is loaded once per process and a model file replaced on disk
+    is picked up on the next ``get``; the stale instance is dropped. Every
+    newly loaded model is run on blank batches so the first real request
+    does not pay for graph tracing. The registry is thread-safe and
+    lives at module level, so a long-running worker and an embedding host
+    such as Python.NET, which imports the module once, share one instance
+    per model.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.RLock()
+        self.loads = 0
+
+    def model_key(self, model_path, fully_convolutional=False):
+        stat = os.stat(model_path)
+        return (
+            os.path.abspath(model_path),
+            stat.st_size,
+            stat.st_mtime_ns,
+            fully_convolutional,
+        )
+
+    def get(self, model_path, fully_convolutional=False):
+        """Return the shared model for a file, loading and warming it if needed.
+
+        With ``fully_convolutional`` the model is rebuilt on a
+        (None, None, 3) input with the same weights, for inputs of any size
+        divisible by 16.
+        """
+        key = self.model_key(model_path, fully_convolutional)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                return model
+
+            is_tflite = model_path.lower().endswith(TFLITE_EXTENSION)
+            if fully_convolutional and is_tflite:
+                raise ValueError(f"A fully convolutional model needs a Keras model, not {model_path}")
+            if fully_convolutional:
+                model = self._fully_convolutional(self.get(model_path))
+            elif is_tflite:
+                model = TFLiteModel(model_path, num_threads=_intra_op_threads)
+                self.loads += 1
+            else:
+                from tensorflow.keras.models import load_model
+
+                model = load_model(model_path, compile=False)
+                self.loads += 1
+            self._warm_up(model)
+
+            # Drop the instance built from an older version of the file
+            for stale in [k for k in self._models if k[0] == key[0] and k[3] == key[3]]:
+                del self._models[stale]
+            self._models[key] = model
+            return model
+
+    def _fully_convolutional(self, model):
+        from tensorflow.keras import Input
+        from tensorflow.keras.models import clone_model
+
+        fcn_model = clone_model(model, input_tensors=[Input((None, None, 3))])
+        fcn_model.set_weights(model.get_weights())
+        return fcn_model
+
+    def _warm_up(self, model):
+        shape = [WARMUP_TILE if dim is None else dim for dim in model.input_shape[1:]]
+        # Two batch sizes, so the traced predict function is relaxed to any
+        # batch size instead of being retraced for the first real batch
+        for batch_size in (1, 2):
+            model.predict_on_batch(np.zeros((batch_size, *shape), dtype=np.float32))
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+MODEL_REGISTRY = ModelRegistry()
+
+
+def set_thread_budget(intra_op_threads, inter_op_threads=1):
+    """Limit the threads TensorFlow uses in this process.
+
+    Must run before the first model is loaded, since TensorFlow fixes its
+    thread pools when the runtime starts; batch workers call it first thing.
+    TensorFlow Lite models loaded afterwards use ``intra_op_threads`` too.
+    """
+    global _intra_op_threads
+    _intra_op_threads = intra_op_threads
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def get_model(model_path, fully_convolutional=False):
+    """Shared, warmed-up model for a file from the process-wide registry"""
+    return MODEL_REGISTRY.get(model_path, fully_convolutional)
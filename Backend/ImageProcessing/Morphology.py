@@ -0,0 +1,83 @@
+import cv2 as cv
+import numpy as np
+
+# "opencv" applies elliptical structuring elements with cv.erode/cv.dilate,
+# "distance" thresholds one Euclidean distance transform per operation and
+# "auto" picks "distance" for radii where it is faster
+ENGINES = ("opencv", "distance", "auto")
+# A distance transform costs about as much as eroding with a radius 16 disk
+AUTO_MIN_RADIUS = 16
+
+
+class MorphologyEngine:
+    """Binary erode/dilate/close/open on 0/255 uint8 masks.
+
+    Operations take the size of an elliptical structuring element and an
+    iteration count, like the cv.getStructuringElement calls they replace.
+    The ``distance`` engine treats ``iterations`` passes of a ``size`` ellipse
+    as one disk of radius ``iterations * (size // 2)`` and applies it by
+    thresholding a distance transform, so its cost does not grow with the
+    kernel or the iterations; results match the ``opencv`` engine up to the
+    rasterisation of the ellipse (even sizes are off-centre by half a pixel
+    per pass in OpenCV). ``auto`` uses it from AUTO_MIN_RADIUS up and OpenCV
+    for smaller kernels. With ``downsample`` above 1 the operation runs on a
+    mask shrunk by that factor and is scaled back up, trading edge accuracy
+    for speed.
+    """
+
+    def __init__(self, engine="opencv", downsample=1):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown morphology engine: {engine}")
+        self.engine = engine
+        self.downsample = max(1, int(downsample))
+
+    def params(self):
+        return [self.engine, self.downsample]
+
+    def erode(self, mask, size, iterations=1):
+        return self._apply(mask, size, iterations, erode=True)
+
+    def dilate(self, mask, size, iterations=1):
+        return self._apply(mask, size, iterations, erode=False)
+
+    def close(self, mask, size, iterations=1):
+        """Dilate then erode, as cv.MORPH_CLOSE with ``iterations``"""
+        return self.erode(self.dilate(mask, size, iterations), size, iterations)
+
+    def open(self, mask, size, iterations=1):
+        """Erode then dilate, as cv.MORPH_OPEN with ``iterations``"""
+        return self.dilate(self.erode(mask, size, iterations), size, iterations)
+
+    def _apply(self, mask, size, iterations, erode):
+        if self.downsample == 1:
+            return self._operate(mask, size, iterations, erode, scale=1)
+
+        height, width = mask.shape[:2]
+        small = cv.resize(
+            mask,
+            (max(1, width // self.downsample), max(1, height // self.downsample)),
+            interpolation=cv.INTER_AREA,
+        )
+        small = np.where(small >= 128, 255, 0).astype(np.uint8)
+        small = self._operate(small, size, iterations, erode, self.downsample)
+        restored = cv.resize(small, (width, height), interpolation=cv.INTER_LINEAR)
+        return np.where(restored >= 128, 255, 0).astype(np.uint8)
+
+    def _operate(self, mask, size, iterations, erode, scale):
+        radius = iterations * (size // 2)
+        if self.engine == "opencv" or (self.engine == "auto" and radius < AUTO_MIN_RADIUS):
+            size = max(1, round(size / scale))
+            kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (size, size))
+            operation = cv.erode if erode else cv.dilate
+            return operation(mask, kernel, iterations=iterations)
+
+        radius /= scale
+        if erode:
+            # Kept where the nearest background pixel is beyond the radius;
+            # like cv.erode, the image border does not count as background
+            distance = cv.distanceTransform(mask, cv.DIST_L2, cv.DIST_MASK_5)
+            kept = cv.threshold(distance, radius, 255, cv.THRESH_BINARY)[1]
+            return kept.astype(np.uint8)
+        distance = cv.distanceTransform(cv.bitwise_not(mask), cv.DIST_L2, cv.DIST_MASK_5)
+        kept = cv.threshold(distance, radius, 255, cv.THRESH_BINARY_INV)[1]
+        return kept.astype(np.uint8)
@@ -0,0 +1,98 @@
+import queue
+import threading
+
+_DONE = object()
+# Seconds between checks for a failed stage while waiting on a queue
+_POLL_SECONDS = 0.1
+
+
+def _put(items, item, stop):
+    """Put ``item`` on a bounded queue unless the pipeline is stopping"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(items, stop):
+    """Next item of a queue, or _DONE once the pipeline is stopping"""
+    while not stop.is_set():
+        try:
+            return items.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _run_stage(stop, errors, stage, *args):
+    """Run one stage; its exception is recorded and stops the other stages"""
+    try:
+        stage(*args)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+
+
+def _produce_items(produce, inputs, stop):
+    try:
+        for item in produce():
+            if not _put(inputs, item, stop):
+                return
+    finally:
+        _put(inputs, _DONE, stop)
+
+
+def _transform_items(transform, inputs, outputs, stop):
+    item = _get(inputs, stop)
+    while item is not _DONE and _put(outputs, transform(item), stop):
+        item = _get(inputs, stop)
+    _put(outputs, _DONE, stop)
+
+
+def _consume_items(consume, outputs, stop):
+    item = _get(outputs, stop)
+    while item is not _DONE:
+        consume(item)
+        item = _get(outputs, stop)
+
+
+def run_pipelined(produce, transform, consume, depth=2):
+    """Run ``consume(transform(item))`` for every item ``produce()`` yields,
+    with the three stages overlapping.
+
+    ``produce`` runs on a producer thread and ``consume`` on a consumer
+    thread, connected to ``transform`` on the calling thread by queues of at
+    most ``depth`` items. Items are consumed in the order they were produced.
+    The first exception raised by any stage stops the pipeline and is
+    re-raised here.
+    """
+    inputs = queue.Queue(depth)
+    outputs = queue.Queue(depth)
+    stop = threading.Event()
+    errors = []
+
+    threads = [
+        threading.Thread(
+            target=_run_stage,
+            args=(stop, errors, _produce_items, produce, inputs, stop),
+            name="pipeline-producer",
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_run_stage,
+            args=(stop, errors, _consume_items, consume, outputs, stop),
+            name="pipeline-consumer",
+            daemon=True,
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+    _run_stage(stop, errors, _transform_items, transform, inputs, outputs, stop)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+from TrackCommon import to_json_compatible
+
+CACHE_EXTENSION = ".npz"
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+BOUNDARY_KEYS = ("success", "outer_boundary", "inner_boundary", "error")
+# Statistics of the run that produced a result, which a cache hit did not repeat
+RUN_STATS_KEYS = ("adaptive", "prefilter", "incremental")
+
+
+class ResultCache:
+    """On-disk cache of processImageForCSharp results.
+
+    Entries are keyed by a SHA-256 of the image bytes plus the processor's
+    pipeline parameters, so changing a threshold or the number of edge points
+    never serves a stale result. Only successful results are stored, without
+    their per-run statistics, and hits are marked ``"cached": true``. Every
+    hit refreshes the entry's mtime, and the least recently used entries are
+    evicted once the directory grows past ``max_bytes``. Several processes
+    may share one directory.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, img_path, params):
+        digest = hashlib.sha256()
+        with open(img_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as entry:
+                result = {
+                    "success": True,
+                    "outer_boundary": entry["outer_boundary"],
+                    "inner_boundary": entry["inner_boundary"],
+                    "error": None,
+                    "cached": True,
+                }
+                # Diagnostics such as boundary_selection ride along as JSON
+                result.update(json.loads(str(entry["extra"])))
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if not result["success"]:
+            return
+
+        extra = {name: value for name, value in result.items() if name not in BOUNDARY_KEYS and name not in RUN_STATS_KEYS}
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    outer_boundary=np.asarray(result["outer_boundary"], np.float32),
+                    inner_boundary=np.asarray(result["inner_boundary"], np.float32),
+                    extra=np.array(json.dumps(extra, default=to_json_compatible)),
+                )
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(CACHE_EXTENSION):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def fetch(self, img_path, params, compute):
+        """Return the cached result for an image, or compute and store it"""
+        try:
+            key = self.make_key(img_path, params)
+        except OSError:
+            # Unreadable image: let the processor report the load failure
+            self.misses += 1
+            return compute(img_path)
+
+        result = self.get(key)
+        if result is None:
+            result = compute(img_path)
+            self.put(key, result)
+        return result
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
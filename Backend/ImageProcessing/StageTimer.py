@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = 0.0
+        self.start_bytes = 0
+        self.peak_bytes = 0
+
+    def __enter__(self):
+        timer = self.timer
+        if timer.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Fold the peak so far into enclosing stages before resetting it
+            for stage in timer._stack():
+                stage.peak_bytes = max(stage.peak_bytes, peak)
+            tracemalloc.reset_peak()
+            self.start_bytes = current
+            self.peak_bytes = current
+        timer._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        timer = self.timer
+        active = timer._stack()
+        active.pop()
+
+        peak = None
+        if timer.track_memory:
+            self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1])
+            if active:
+                parent = active[-1]
+                parent.peak_bytes = max(parent.peak_bytes, self.peak_bytes)
+            peak = self.peak_bytes - self.start_bytes
+
+        timer.events.append(
+            {
+                "name": self.name,
+                "start": self.start - timer.origin,
+                "duration": end - self.start,
+                "peak_bytes": peak,
+                "thread": threading.get_ident(),
+            }
+        )
+        return False
+
+
+class StageTimer:
+    """Opt-in wall time and peak memory recorder for pipeline stages.
+
+    Use as ``with timer.stage("bilateral"): ...``. When disabled, ``stage``
+    returns a shared no-op context manager, so instrumentation can stay in
+    production code. Peak memory is measured with ``tracemalloc``, which sees
+    NumPy and OpenCV output arrays but not allocations made inside native
+    libraries such as TensorFlow; it is reported relative to the memory in
+    use when the stage started.
+    """
+
+    def __init__(self, enabled=False, track_memory=True):
+        self.enabled = enabled
+        self.track_memory = enabled and track_memory
+        self.events = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        self.events = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+
+    def _stack(self):
+        # Stages opened by the current thread, innermost last
+        if not hasattr(self._local, "active"):
+            self._local.active = []
+        return self._local.active
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def summary(self):
+        """Per-stage totals in first-seen order, for the result's timings block"""
+        stages = {}
+        for event in self.events:
+            entry = stages.setdefault(
+                event["name"],
+                {"name": event["name"], "calls": 0, "ms": 0.0, "peak_mb": None},
+            )
+            entry["calls"] += 1
+            entry["ms"] += event["duration"] * 1000.0
+            if event["peak_bytes"] is not None:
+                peak_mb = event["peak_bytes"] / (1024 * 1024)
+                entry["peak_mb"] = max(entry["peak_mb"] or 0.0, peak_mb)
+
+        total = 0.0
+        if self.events:
+            end = max(event["start"] + event["duration"] for event in self.events)
+            total = end * 1000.0
+        return {"total_ms": total, "stages": list(stages.values())}
+
+    def chrome_trace(self):
+        """Events in Chrome trace format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        trace_events = []
+        for event in self.events:
+            trace_event = {
+                "name": event["name"],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["duration"] * 1e6,
+                "pid": pid,
+                "tid": event["thread"],
+            }
+            if event["peak_bytes"] is not None:
+                trace_event["args"] = {"peak_bytes": event["peak_bytes"]}
+            trace_events.append(trace_event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, output_file):
+        with open(output_file, "w") as f:
+            json.dump(self.chrome_trace(), f)
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+TILE_EXTENSION = ".npy"
+DEFAULT_TILE_CACHE_BYTES = 128 * 1024 * 1024
+DEFAULT_TILE_DISK_BYTES = 1024 * 1024 * 1024
+# Eviction frees this much below the disk limit, so it does not rescan the
+# directory on every new tile once the cache is full
+EVICT_TO = 0.9
+
+
+class TileCache:
+    """Cache of per-tile model predictions.
+
+    Entries are keyed by a hash of the tile's uint8 pixels plus a model
+    identity string, so byte-identical tiles, whether repeated within an
+    image or across resubmitted images, are predicted once per model file.
+    Predictions are kept in an in-memory LRU of at most ``max_bytes`` and,
+    with ``cache_dir``, also written to disk, where they survive restarts
+    and are shared between processes. Disk hits refresh the file's mtime,
+    and the least recently used files are evicted once the directory grows
+    past ``max_disk_bytes``. The cache is thread-safe.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_TILE_CACHE_BYTES, cache_dir=None, max_disk_bytes=DEFAULT_TILE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        # Bytes this process believes are on disk, counted on the first write
+        self._disk_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # Batch workers each get an empty in-memory LRU and their own lock;
+        # the disk cache, if any, is what they share
+        state = dict(self.__dict__, hits=0, misses=0, _entries=OrderedDict(), _bytes=0, _disk_bytes=None)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def make_key(self, tile, model_id):
+        digest = hashlib.blake2b(model_id.encode("utf-8"), digest_size=20)
+        digest.update(np.ascontiguousarray(tile).tobytes())
+        digest.update(str(tile.shape).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + TILE_EXTENSION)
+
+    def get(self, key):
+        with self._lock:
+            prediction = self._entries.get(key)
+            if prediction is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prediction
+
+        if self.cache_dir:
+            path = self._entry_path(key)
+            try:
+                prediction = np.load(path)
+                os.utime(path)
+            except (OSError, ValueError):
+                prediction = None
+            if prediction is not None:
+                self._remember(key, prediction)
+                with self._lock:
+                    self.hits += 1
+                return prediction
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, prediction):
+        prediction = np.array(prediction, dtype=np.float32)
+        self._remember(key, prediction)
+        if not self.cache_dir:
+            return
+
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, prediction)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += os.path.getsize(path)
+            full = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+        if full:
+            self.evict()
+
+    def _disk_entries(self):
+        """(mtime, size, path) of every tile file in the cache directory"""
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith(TILE_EXTENSION):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    def evict(self):
+        """Remove least recently used files until the disk cache fits in max_disk_bytes"""
+        entries = list(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_disk_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_disk_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remember(self, key, prediction):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = prediction
+            self._bytes += prediction.nbytes
+            # Least recently used entries go first
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._entries),
+        }
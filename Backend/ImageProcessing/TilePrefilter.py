@@ -0,0 +1,231 @@
+import argparse
+import glob
+import json
+import os
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 128
+# Per-tile features; a tile is skipped when it has too little asphalt and is
+# either too uniform or has too few edges to hold part of the track
+FEATURES = ("asphalt_fraction", "grey_std", "edge_density")
+# Candidate thresholds per feature tried by calibrate
+CALIBRATION_STEPS = 17
+# Asphalt bin of the HSV histogram: unsaturated, neither black nor white
+ASPHALT_MAX_SATURATION = 60
+ASPHALT_VALUE_RANGE = (25, 200)
+# Grey level step between neighbouring pixels that counts as an edge
+EDGE_STEP = 24
+
+
+def tile_features(tiles):
+    """FEATURES of a (N, h, w, 3) uint8 RGB tile batch as an (N, 3) array.
+
+    All tiles are converted and measured in one call: the share of pixels in
+    the asphalt bin of the HSV histogram, the grey level standard deviation
+    and the share of pixels with a grey step above EDGE_STEP to their right
+    or lower neighbour.
+    """
+    tiles = np.ascontiguousarray(tiles, dtype=np.uint8)
+    count, height, width = tiles.shape[:3]
+    features = np.zeros((count, len(FEATURES)), dtype=np.float32)
+    if count == 0:
+        return features
+
+    # OpenCV converts one image, so stack the tiles vertically
+    stacked = tiles.reshape(count * height, width, 3)
+    hsv = cv.cvtColor(stacked, cv.COLOR_RGB2HSV).reshape(count, height, width, 3)
+    grey = cv.cvtColor(stacked, cv.COLOR_RGB2GRAY).reshape(count, height, width)
+
+    saturation, value = hsv[..., 1], hsv[..., 2]
+    asphalt = (saturation <= ASPHALT_MAX_SATURATION) & (value >= ASPHALT_VALUE_RANGE[0]) & (value <= ASPHALT_VALUE_RANGE[1])
+    features[:, 0] = asphalt.mean(axis=(1, 2))
+    features[:, 1] = grey.reshape(count, -1).std(axis=1)
+
+    grey = grey.astype(np.int16)
+    edges = np.zeros(grey.shape, dtype=bool)
+    edges[:, :, :-1] |= np.abs(np.diff(grey, axis=2)) > EDGE_STEP
+    edges[:, :-1, :] |= np.abs(np.diff(grey, axis=1)) > EDGE_STEP
+    features[:, 2] = edges.mean(axis=(1, 2))
+    return features
+
+
+class TilePrefilter:
+    """Skips tiles that cannot contain track before they reach the model.
+
+    A tile is skipped when its asphalt fraction is below the calibrated
+    threshold and so is its grey spread or its edge density, e.g. uniform
+    grass, sky or UI panels. Uniform asphalt in the middle of a wide track
+    is kept by its asphalt fraction. Thresholds come from ``calibrate`` on
+    labelled training tiles and are stored as JSON.
+    """
+
+    def __init__(self, thresholds):
+        self.thresholds = {name: float(thresholds[name]) for name in FEATURES}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)["thresholds"])
+
+    def skip(self, tiles):
+        """Boolean array, True for tiles predicted to hold no track"""
+        low = tile_features(tiles) < np.array([self.thresholds[name] for name in FEATURES])
+        return low[:, 0] & (low[:, 1] | low[:, 2])
+
+
+def load_labelled_tiles(image_dir, max_images=None, crop=False):
+    """RGB uint8 tiles and their track coverage from ``*_sat.jpg``/``*_mask.png``.
+
+    By default each image is resized to one tile, as the model was trained.
+    With ``crop`` the image is cut into 128 px tiles at full resolution,
+    which matches how track screenshots are tiled for inference.
+    """
+    paths = sorted(glob.glob(os.path.join(image_dir, "*_sat.jpg")))
+    if max_images:
+        paths = paths[:max_images]
+
+    tiles, coverage = [], []
+    for path in paths:
+        mask_path = path[: -len("_sat.jpg")] + "_mask.png"
+        if not os.path.exists(mask_path):
+            continue
+        img = Image.open(path).convert("RGB")
+        mask = Image.open(mask_path).convert("L")
+        if not crop:
+            img = img.resize((TILE_SIZE, TILE_SIZE))
+            mask = mask.resize((TILE_SIZE, TILE_SIZE), Image.NEAREST)
+        img, mask = np.asarray(img), np.asarray(mask) > 0
+
+        rows, cols = mask.shape[0] // TILE_SIZE, mask.shape[1] // TILE_SIZE
+        for y in range(0, rows * TILE_SIZE, TILE_SIZE):
+            for x in range(0, cols * TILE_SIZE, TILE_SIZE):
+                tiles.append(img[y : y + TILE_SIZE, x : x + TILE_SIZE])
+                coverage.append(mask[y : y + TILE_SIZE, x : x + TILE_SIZE].mean())
+
+    tiles = np.asarray(tiles, dtype=np.uint8).reshape(-1, TILE_SIZE, TILE_SIZE, 3)
+    return tiles, np.asarray(coverage, dtype=np.float32)
+
+
+def skip_rates(prefilter, tiles, coverage):
+    """Skip rates of track tiles (false skips), tiles fully on the track and empty tiles"""
+    skipped = prefilter.skip(tiles)
+    track, full, empty = coverage > 0, coverage == 1, coverage == 0
+    return {
+        "track_tiles": int(track.sum()),
+        "full_track_tiles": int(full.sum()),
+        "empty_tiles": int(empty.sum()),
+        "false_skip_rate": float(skipped[track].mean()) if track.any() else 0.0,
+        "full_track_skip_rate": float(skipped[full].mean()) if full.any() else 0.0,
+        "empty_skip_rate": float(skipped[empty].mean()) if empty.any() else 0.0,
+    }
+
+
+def candidate_thresholds(features):
+    """Per feature, thresholds just above evenly spaced quantiles of ``features``"""
+    quantiles = np.quantile(features, np.linspace(0, 1, CALIBRATION_STEPS), axis=0)
+    return np.nextafter(quantiles, np.inf).T
+
+
+def calibrate(tiles, coverage, target_false_skip=0.01, holdout=0.2, seed=0):
+    """Fit thresholds on labelled tiles and measure them on a held-out split.
+
+    Candidate thresholds are quantiles of each feature over all fitting
+    tiles, empty and track alike. The combination that skips the most empty
+    tiles while skipping at most ``target_false_skip`` of the track tiles is
+    kept. Returns the prefilter and a report with the fit and held-out skip
+    rates.
+    """
+    order = np.random.default_rng(seed).permutation(len(tiles))
+    split = int(len(tiles) * holdout)
+    test, fit = order[:split], order[split:]
+
+    features, track = tile_features(tiles[fit]), coverage[fit] > 0
+    if not track.any() or track.all():
+        raise ValueError("Calibration needs tiles with and without track")
+    allowed = target_false_skip * track.sum()
+    asphalt, grey_std, edges = candidate_thresholds(features)
+    low_std = features[:, 1] < grey_std[:, None]
+    low_edges = features[:, 2] < edges[:, None]
+
+    best, best_score = None, None
+    for asphalt_threshold in asphalt:
+        # Skips for every grey_std x edge_density pair at once
+        skipped = (features[:, 0] < asphalt_threshold) & (low_std[:, None] | low_edges[None])
+        false_skips = skipped[..., track].sum(axis=-1)
+        empty_skips = skipped[..., ~track].sum(axis=-1)
+        score = np.where(false_skips <= allowed, empty_skips, -1)
+        i, j = np.unravel_index(np.argmax(score), score.shape)
+        if score[i, j] >= 0 and (best_score is None or score[i, j] > best_score):
+            best, best_score = (asphalt_threshold, grey_std[i], edges[j]), score[i, j]
+    if best is None:
+        raise ValueError(f"No thresholds skip at most {target_false_skip:.2%} of the track tiles")
+    prefilter = TilePrefilter(dict(zip(FEATURES, best)))
+
+    report = {
+        "thresholds": prefilter.thresholds,
+        "target_false_skip_rate": target_false_skip,
+        "fit": skip_rates(prefilter, tiles[fit], coverage[fit]),
+        "holdout": None,
+    }
+    if len(test):
+        report["holdout"] = skip_rates(prefilter, tiles[test], coverage[test])
+    return prefilter, report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate the CNN tile pre-filter on labelled training tiles")
+    parser.add_argument(
+        "--train-dir",
+        default="data/train",
+        help="Images (*_sat.jpg) and masks (*_mask.png) (default: data/train)",
+    )
+    parser.add_argument(
+        "--output",
+        default="tile_prefilter.json",
+        help="Calibration file for CNN.py --prefilter (default: tile_prefilter.json)",
+    )
+    parser.add_argument("--max-images", type=int, default=None, help="Limit the images used")
+    parser.add_argument(
+        "--crop",
+        action="store_true",
+        help="Cut images into 128 px tiles instead of resizing them to one",
+    )
+    parser.add_argument(
+        "--target-false-skip",
+        type=float,
+        default=0.01,
+        help="Share of track tiles the thresholds may skip (default: 0.01)",
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    tiles, coverage = load_labelled_tiles(args.train_dir, args.max_images, args.crop)
+    prefilter, report = calibrate(tiles, coverage, args.target_false_skip)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    thresholds = prefilter.thresholds
+    print(
+        f"skip if asphalt_fraction < {thresholds['asphalt_fraction']:.4f} and "
+        f"(grey_std < {thresholds['grey_std']:.4f} or edge_density < {thresholds['edge_density']:.4f})"
+    )
+    for split in ("fit", "holdout"):
+        rates = report[split]
+        if rates:
+            print(
+                f"{split:<8} track tiles {rates['track_tiles']:>6}  "
+                f"false skips {rates['false_skip_rate']:.2%}  "
+                f"full track tiles {rates['full_track_tiles']:>6} skipped {rates['full_track_skip_rate']:.2%}  "
+                f"empty tiles {rates['empty_tiles']:>6}  "
+                f"skipped {rates['empty_skip_rate']:.2%}"
+            )
+    print(f"Calibration written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 import tensorflow as tf
+from ModelRegistry import get_model
 from PIL import Image
 
 # Create output directory if it doesn't exist
@@ -357,13 +358,19 @@ def load_saved_model(model_path):
     """
     Load and compile a saved Keras model.
 
+    The file is read once through the process-wide registry. The caller
+    gets its own copy of the shared model, so compiling or training it does
+    not touch the instance the processors predict with.
+
     Args:
         model_path: Path to the saved .keras model file
 
     Returns:
         Loaded and compiled Keras model
     """
-    model = tf.keras.models.load_model(model_path, compile=False)
+    shared_model = get_model(model_path)
+    model = tf.keras.models.clone_model(shared_model)
+    model.set_weights(shared_model.get_weights())
     model.compile(optimizer="rmsprop", loss="binary_crossentropy", metrics=["accuracy"])
     print(f"Model loaded from {model_path}")
     return model
@@ -519,6 +526,10 @@ def calculate_f1_score(
         mask_dir: Directory containing ground truth masks
         output_file: File path to save results
         max_samples: Maximum number of samples to evaluate (None for all)
+
+    Returns:
+        dict with precision, recall, f1, mean_iou and samples, or None if
+        nothing could be evaluated
     """
 
     def get_iou(y_true, y_pred):
@@ -612,6 +623,14 @@ Mean IoU: {mean_iou:.4f}
         f.write(results)
     print(f"Metrics saved to {output_file}")
 
+    return {
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1": float(f1),
+        "mean_iou": float(mean_iou),
+        "samples": processed,
+    }
+
 
 def predict_custom_image(model, image_path, output_dir):
     """
@@ -0,0 +1,129 @@
+import json
+import sys
+
+import numpy as np
+
+NUM_EDGE_POINTS = 4550  # Fixed number of points for each boundary
+EDGE_BINARY_MAGIC = b"EDGB"
+EDGE_BINARY_VERSION = 1
+
+
+def resample_contour(contour, target_points=NUM_EDGE_POINTS):
+    """Resample a contour to evenly spaced points along its arc length.
+
+    Accepts an OpenCV contour or any array of (x, y) points and returns a
+    contiguous float32 array of shape (target_points, 2). Degenerate contours
+    with zero length are returned as-is, and contours with fewer than two
+    points give an empty (0, 2) array.
+    """
+    points = np.asarray(contour, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return np.empty((0, 2), dtype=np.float32)
+
+    segment_lengths = np.hypot(*np.diff(points, axis=0).T)
+    dist = np.empty(len(points), dtype=np.float64)
+    dist[0] = 0.0
+    np.cumsum(segment_lengths, out=dist[1:])
+
+    if dist[-1] == 0:
+        return np.ascontiguousarray(points, dtype=np.float32)
+
+    interp_dist = np.linspace(0, dist[-1], target_points)
+    resampled = np.empty((target_points, 2), dtype=np.float32)
+    resampled[:, 0] = np.interp(interp_dist, dist, points[:, 0])
+    resampled[:, 1] = np.interp(interp_dist, dist, points[:, 1])
+    return resampled
+
+
+def to_json_compatible(value):
+    """json default hook that turns NumPy arrays and scalars into plain lists/numbers"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def result_to_json(result):
+    """Serialize a result dict compactly, converting boundary arrays on the way out"""
+    return json.dumps(result, separators=(",", ":"), default=to_json_compatible)
+
+
+def failure_result(error):
+    """Result dict for a request that could not be processed"""
+    return {
+        "success": False,
+        "outer_boundary": [],
+        "inner_boundary": [],
+        "error": error,
+    }
+
+
+def write_result_to_file(result, output_file):
+    """Write result to file instead of printing to stdout"""
+    try:
+        with open(output_file, "w") as f:
+            json.dump(result, f, separators=(",", ":"), default=to_json_compatible)
+        return True
+    except Exception as e:
+        print(f"Error writing to file: {e}", file=sys.stderr)
+        return False
+
+
+def write_result_to_binary(result, output_file, include_header=False):
+    """Write boundaries in the EdgeData.LoadFromBinary layout.
+
+    The file holds, little-endian, an int32 point count followed by float32
+    (x, y) pairs for the outer boundary, then the same for the inner
+    boundary. With ``include_header`` the points are preceded by the
+    ``EDGE_BINARY_MAGIC`` bytes, a uint32 format version, a uint32 success
+    flag and a uint32-length-prefixed UTF-8 error message; readers that only
+    expect the raw layout must be given files without the header.
+    """
+    try:
+        with open(output_file, "wb") as f:
+            if include_header:
+                error = (result.get("error") or "").encode("utf-8")
+                f.write(EDGE_BINARY_MAGIC)
+                np.array(
+                    [EDGE_BINARY_VERSION, int(bool(result["success"])), len(error)],
+                    dtype="<u4",
+                ).tofile(f)
+                f.write(error)
+
+            for key in ("outer_boundary", "inner_boundary"):
+                points = np.ascontiguousarray(result[key], dtype="<f4").reshape(-1, 2)
+                np.array([len(points)], dtype="<i4").tofile(f)
+                points.tofile(f)
+        return True
+    except Exception as e:
+        print(f"Error writing to file: {e}", file=sys.stderr)
+        return False
+
+
+def read_result_from_binary(input_file):
+    """Read a file written by write_result_to_binary, with or without header"""
+    with open(input_file, "rb") as f:
+        data = f.read()
+
+    result = {"success": True, "error": None}
+    pos = 0
+    if data[:4] == EDGE_BINARY_MAGIC:
+        _, success, error_len = np.frombuffer(data, dtype="<u4", count=3, offset=4)
+        pos = 16 + int(error_len)
+        result["success"] = bool(success)
+        result["error"] = data[16:pos].decode("utf-8") or None
+
+    for key in ("outer_boundary", "inner_boundary"):
+        count = int(np.frombuffer(data, dtype="<i4", count=1, offset=pos)[0])
+        pos += 4
+        result[key] = np.frombuffer(data, dtype="<f4", count=count * 2, offset=pos).reshape(-1, 2)
+        pos += count * 8
+    return result
+
+
+def write_result(result, output_file, binary_header=False):
+    """Write result as EdgeData binary for ``.bin`` paths, JSON otherwise"""
+    if output_file.lower().endswith(".bin"):
+        return write_result_to_binary(result, output_file, binary_header)
+    return write_result_to_file(result, output_file)
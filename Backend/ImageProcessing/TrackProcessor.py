@@ -1,44 +1,97 @@
+import argparse
+import glob
 import json
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import cv2 as cv
 import numpy as np
-from scipy.interpolate import interp1d
-
-NUM_EDGE_POINTS = 4550  # Fixed number of points for each boundary
+from ResultCache import DEFAULT_CACHE_BYTES, ResultCache
+from StageTimer import StageTimer
+from TrackCommon import (
+    NUM_EDGE_POINTS,
+    failure_result,
+    resample_contour,
+    result_to_json,
+    write_result,
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+BATCH_SUMMARY_NAME = "batch_summary"
+
+
+def otsu_threshold(img, extra_zeros=0):
+    """Otsu threshold of an 8-bit image as if it had ``extra_zeros`` more 0 pixels"""
+    hist = cv.calcHist([img], [0], None, [256], [0, 256]).ravel().astype(np.float64)
+    hist[0] += extra_zeros
+    prob = hist / hist.sum()
+    omega = np.cumsum(prob)
+    mu = np.cumsum(prob * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma_b = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    valid = (omega > np.finfo(np.float32).eps) & (1.0 - omega > np.finfo(np.float32).eps)
+    if not valid.any():
+        return 0
+    return int(np.argmax(np.where(valid, sigma_b, -1.0)))
 
 
 class TrackProcessor:
-    def __init__(self):
+    # HSV range that counts as dark track surface
+    LOWER_BLACK = (0, 0, 0)
+    UPPER_BLACK = (180, 255, 150)
+    BILATERAL_DIAMETER = 10
+    BILATERAL_SIGMA_COLOR = 130
+    BILATERAL_SIGMA_SPACE = 75
+    MORPH_KERNEL_SIZE = (2, 2)
+    CANNY_THRESHOLDS = (85, 170)
+    # Wider than the combined reach of the bilateral and morphology kernels
+    ROI_PADDING = 16
+    # Cell filter grid cell size, and the share of mixed cells above which
+    # filtering the whole ROI at once is faster
+    FILTER_CELL = 32
+    MAX_MIXED_CELLS = 0.5
+
+    def __init__(
+        self,
+        result_cache=None,
+        use_roi=True,
+        skip_uniform_cells=False,
+        instrument=False,
+    ):
         self.original_image = None
         self.processed_image = None
         self.track_mask = None
         self.track_boundaries = None
+        self.result_cache = result_cache
+        self.use_roi = use_roi
+        self.roi = None
+        # Only filter grid cells whose neighbourhood in the dark mask is mixed
+        self.skip_uniform_cells = skip_uniform_cells
+        self.boundary_selection = None
+        # Per-stage wall time and peak memory, reported under "timings"
+        self.timer = StageTimer(instrument)
+
+    def pipelineParams(self):
+        """Parameters that determine the output, used to key cached results"""
+        # Skipping uniform cells gives the same output, so it is not part of the key
+        return {
+            "processor": "TrackProcessor",
+            "lower_black": self.LOWER_BLACK,
+            "upper_black": self.UPPER_BLACK,
+            "bilateral": (
+                self.BILATERAL_DIAMETER,
+                self.BILATERAL_SIGMA_COLOR,
+                self.BILATERAL_SIGMA_SPACE,
+            ),
+            "morph_kernel_size": self.MORPH_KERNEL_SIZE,
+            "canny_thresholds": self.CANNY_THRESHOLDS,
+            "num_edge_points": NUM_EDGE_POINTS,
+        }
 
     def resampleContour(self, contour, target_points=NUM_EDGE_POINTS):
-        if len(contour) < 2:
-            return []
-
-        contour = contour.squeeze()
-        if contour.ndim != 2:
-            contour = contour.reshape(-1, 2)
-
-        x = contour[:, 0]
-        y = contour[:, 1]
-        dist = np.sqrt(np.diff(x) ** 2 + np.diff(y) ** 2)
-        dist = np.concatenate([[0], np.cumsum(dist)])
-
-        if dist[-1] == 0:
-            return [[float(x[i]), float(y[i])] for i in range(len(x))]
-
-        interp_dist = np.linspace(0, dist[-1], target_points)
-        interp_func_x = interp1d(dist, x, kind="linear")
-        interp_func_y = interp1d(dist, y, kind="linear")
-        x_interp = interp_func_x(interp_dist)
-        y_interp = interp_func_y(interp_dist)
-
-        return [[float(x), float(y)] for x, y in zip(x_interp, y_interp)]
+        return resample_contour(contour, target_points)
 
     def loadImg(self, img_path):
         self.original_image = cv.imread(img_path)
@@ -46,141 +99,650 @@ class TrackProcessor:
             raise ValueError(f"Could not load image from {img_path}")
         return self.original_image
 
-    def processImg(self, img):
-        hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
-
-        # Find black track
-        lower_black = np.array([0, 0, 0])
-        upper_black = np.array([180, 255, 150])
-        dark_mask = cv.inRange(hsv, lower_black, upper_black)
-
+    def findRoi(self, dark_mask):
+        """Padded bounding box (x, y, w, h) of the dark pixels, or the whole frame"""
+        height, width = dark_mask.shape[:2]
+        x, y, w, h = cv.boundingRect(dark_mask)
+        if not self.use_roi or w == 0 or h == 0:
+            return 0, 0, width, height
+
+        x0 = max(x - self.ROI_PADDING, 0)
+        y0 = max(y - self.ROI_PADDING, 0)
+        x1 = min(x + w + self.ROI_PADDING, width)
+        y1 = min(y + h + self.ROI_PADDING, height)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def darkMask(self, img):
+        with self.timer.stage("hsv"):
+            hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
+
+            # Find black track
+            lower_black = np.array(self.LOWER_BLACK)
+            upper_black = np.array(self.UPPER_BLACK)
+            return cv.inRange(hsv, lower_black, upper_black)
+
+    def filterMask(self, dark_mask, diameter=None):
+        """Bilateral filter, opening and closing; returns (opening, closing)"""
         # bilateral filter to reduce noise and preserve edges
-        bi_lat_filter = cv.bilateralFilter(dark_mask, 10, 130, 75)
-
-        kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (2, 2))
-        opening = cv.morphologyEx(bi_lat_filter, cv.MORPH_OPEN, kernel, iterations=1)
-        closing = cv.morphologyEx(opening, cv.MORPH_CLOSE, kernel, iterations=1)
-
-        # Otsu's thresholding
-        _, thresh = cv.threshold(closing, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+        with self.timer.stage("bilateral"):
+            bi_lat_filter = cv.bilateralFilter(
+                dark_mask,
+                diameter or self.BILATERAL_DIAMETER,
+                self.BILATERAL_SIGMA_COLOR,
+                self.BILATERAL_SIGMA_SPACE,
+            )
+
+        with self.timer.stage("morphology"):
+            kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, self.MORPH_KERNEL_SIZE)
+            opening = cv.morphologyEx(bi_lat_filter, cv.MORPH_OPEN, kernel, iterations=1)
+            closing = cv.morphologyEx(opening, cv.MORPH_CLOSE, kernel, iterations=1)
+        return opening, closing
 
+    def processImg(self, img):
+        dark_mask = self.darkMask(img)
+
+        # The mask is 0 outside the dark pixels' box and stays 0 through the
+        # filters below, so they only need to run on the padded crop
+        x, y, w, h = self.findRoi(dark_mask)
+        self.roi = (x, y, w, h)
+        filtered = self.filterMixedCells(dark_mask, self.roi) if self.skip_uniform_cells else None
+        if filtered is None:
+            filtered = self.filterMask(dark_mask[y : y + h, x : x + w])
+        opening, closing = filtered
+
+        # Otsu's thresholding, counting the cropped-away zeros of the full frame
+        outside_pixels = img.shape[0] * img.shape[1] - w * h
+        with self.timer.stage("otsu"):
+            if outside_pixels:
+                otsu = otsu_threshold(closing, outside_pixels)
+                _, thresh = cv.threshold(closing, otsu, 255, cv.THRESH_BINARY)
+            else:
+                _, thresh = cv.threshold(closing, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+
+        # processed_image and track_mask cover self.roi, not the full frame
         self.processed_image = thresh
         self.track_mask = opening
-        return {"processed_image": thresh}
-
-    def detectBoundaries(self, img):
-        cannyEdges = cv.Canny(img, 85, 170)
-        contours, _ = cv.findContours(cannyEdges, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-
-        if not contours or len(contours) < 3:
+        return {"processed_image": thresh, "offset": (x, y)}
+
+    def uniformCells(self, dark_mask, roi):
+        """Per ROI grid cell: whether its padded neighbourhood is uniform, and whether it is all dark"""
+        x, y, w, h = roi
+        height, width = dark_mask.shape[:2]
+        cell, pad = self.FILTER_CELL, self.ROI_PADDING
+        dark = cv.integral(dark_mask, sdepth=cv.CV_64F)
+
+        top, left = np.arange(y, y + h, cell), np.arange(x, x + w, cell)
+        y0, y1 = np.clip(top - pad, 0, height), np.clip(top + cell + pad, 0, height)
+        x0, x1 = np.clip(left - pad, 0, width), np.clip(left + cell + pad, 0, width)
+        total = dark[np.ix_(y1, x1)] - dark[np.ix_(y0, x1)] - dark[np.ix_(y1, x0)] + dark[np.ix_(y0, x0)]
+        all_dark = total == 255.0 * np.outer(y1 - y0, x1 - x0)
+        return (total == 0) | all_dark, all_dark
+
+    def filterMixedCells(self, dark_mask, roi):
+        """filterMask over the ROI that skips uniform cells; None when too few cells are uniform"""
+        x, y, w, h = roi
+        cell = self.FILTER_CELL
+        with self.timer.stage("cells"):
+            uniform, all_dark = self.uniformCells(dark_mask, roi)
+            if uniform.mean() < 1.0 - self.MAX_MIXED_CELLS:
+                return None
+            # The filters leave a uniform neighbourhood unchanged
+            fill = np.where(all_dark, 255, 0).astype(np.uint8)
+            opening = np.ascontiguousarray(fill.repeat(cell, axis=0).repeat(cell, axis=1)[:h, :w])
+            closing = opening.copy()
+
+        height, width = dark_mask.shape[:2]
+        pad = self.ROI_PADDING
+        for row, mixed in enumerate(~uniform):
+            selected = np.flatnonzero(mixed)
+            run_breaks = np.flatnonzero(np.diff(selected) > 1) + 1
+            for run in np.split(selected, run_breaks) if len(selected) else []:
+                # Cell run in ROI coordinates, then padded in image coordinates
+                cx0, cx1 = run[0] * cell, min((run[-1] + 1) * cell, w)
+                cy0, cy1 = row * cell, min((row + 1) * cell, h)
+                px0, py0 = max(x + cx0 - pad, 0), max(y + cy0 - pad, 0)
+                px1, py1 = min(x + cx1 + pad, width), min(y + cy1 + pad, height)
+
+                run_opening, run_closing = self.filterMask(dark_mask[py0:py1, px0:px1])
+                core = (slice(y + cy0 - py0, y + cy1 - py0), slice(x + cx0 - px0, x + cx1 - px0))
+                opening[cy0:cy1, cx0:cx1] = run_opening[core]
+                closing[cy0:cy1, cx0:cx1] = run_closing[core]
+        return opening, closing
+
+    def detectBoundaries(self, img, offset=(0, 0)):
+        with self.timer.stage("canny"):
+            cannyEdges = cv.Canny(img, *self.CANNY_THRESHOLDS)
+
+        with self.timer.stage("contours"):
+            contours, hierarchy = cv.findContours(cannyEdges, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE, offset=offset)
+            selection = self.selectBoundaries(contours, hierarchy)
+        self.boundary_selection = selection
+        if selection["inner"] is None:
             return None
 
-        contours = sorted(contours, key=cv.contourArea, reverse=True)
-        outer_boundary = contours[0]
-        inner_boundary = contours[2]
+        outer_boundary = contours[selection["outer"]["index"]]
+        inner_boundary = contours[selection["inner"]["index"]]
 
         self.track_boundaries = {"outer": outer_boundary, "inner": inner_boundary}
         return self.track_boundaries
 
+    def largestContour(self, contours, boxes, indices, selection):
+        """Index and area of the largest of ``indices``, skipping contours whose bounding box is already smaller"""
+        best, best_area = None, -1.0
+        for i in indices:
+            if boxes[i][2] * boxes[i][3] <= best_area:
+                continue
+            area = cv.contourArea(contours[i])
+            selection["areas_evaluated"] += 1
+            if area > best_area:
+                best, best_area = i, area
+        return best, best_area
+
+    @staticmethod
+    def contourChildren(tree, parent):
+        child = tree[parent][2]
+        while child != -1:
+            yield child
+            child = tree[child][0]
+
+    def findInnerBoundary(self, contours, tree, boxes, outer, selection):
+        """Walk the hierarchy for the inner boundary; returns (index, area, rule, reason), index None if there is none"""
+        # Every closed Canny line gives an outer contour and a hole just inside it
+        edge_hole, _ = self.largestContour(contours, boxes, self.contourChildren(tree, outer), selection)
+        if edge_hole is not None:
+            inner, inner_area = self.largestContour(contours, boxes, self.contourChildren(tree, edge_hole), selection)
+            if inner is not None:
+                return (
+                    inner,
+                    inner_area,
+                    "largest contour inside the outer boundary",
+                    "Inner boundary nested inside outer boundary",
+                )
+
+        # Tracks whose inner edge is not closed inside the outer one
+        outer_line = {outer, *self.contourChildren(tree, outer)}
+        others = (i for i in range(len(contours)) if i not in outer_line)
+        inner, inner_area = self.largestContour(contours, boxes, others, selection)
+        if inner is None:
+            return None, None, None, "Only one closed boundary found"
+        return (
+            inner,
+            inner_area,
+            "largest contour outside the outer boundary",
+            "Nothing nested inside outer boundary",
+        )
+
+    def selectBoundaries(self, contours, hierarchy):
+        """Choose the outer and inner boundary contours from a Canny contour tree; returns what was chosen and why"""
+        selection = {
+            "contours": len(contours),
+            "areas_evaluated": 0,
+            "outer": None,
+            "inner": None,
+            "reason": None,
+        }
+        if not contours:
+            selection["reason"] = "No contours found"
+            return selection
+
+        boxes = [cv.boundingRect(contour) for contour in contours]
+
+        def describe(index, area, rule):
+            return {
+                "index": int(index),
+                "area": float(area),
+                "bbox": [int(v) for v in boxes[index]],
+                "rule": rule,
+            }
+
+        outer, outer_area = self.largestContour(contours, boxes, range(len(contours)), selection)
+        selection["outer"] = describe(outer, outer_area, "largest contour")
+
+        inner, inner_area, rule, selection["reason"] = self.findInnerBoundary(contours, hierarchy[0], boxes, outer, selection)
+        if inner is not None:
+            selection["inner"] = describe(inner, inner_area, rule)
+        return selection
+
     def processImageForCSharp(self, img_path):
+        self.timer.reset()
+        if self.result_cache is not None:
+            result = self.result_cache.fetch(img_path, self.pipelineParams(), self._processImage)
+        else:
+            result = self._processImage(img_path)
+
+        if self.timer.enabled:
+            result = dict(result, timings=self.timer.summary())
+        return result
+
+    def _processImage(self, img_path):
         try:
-            img = self.loadImg(img_path)
+            with self.timer.stage("load"):
+                img = self.loadImg(img_path)
             if img is None:
-                return {
-                    "success": False,
-                    "outer_boundary": [],
-                    "inner_boundary": [],
-                    "error": "Failed to load image",
-                }
+                return failure_result("Failed to load image")
 
             processed_result = self.processImg(img)
             if processed_result is None:
-                return {
-                    "success": False,
-                    "outer_boundary": [],
-                    "inner_boundary": [],
-                    "error": "Failed to process image",
-                }
+                return failure_result("Failed to process image")
 
-            boundaries = self.detectBoundaries(processed_result["processed_image"])
+            boundaries = self.detectBoundaries(processed_result["processed_image"], processed_result["offset"])
             if boundaries is None:
-                return {
-                    "success": False,
-                    "outer_boundary": [],
-                    "inner_boundary": [],
-                    "error": "Failed to detect track boundaries",
-                }
+                return dict(failure_result("Failed to detect track boundaries"), boundary_selection=self.boundary_selection)
 
             outer_coords = []
             inner_coords = []
 
-            if boundaries["outer"] is not None:
-                outer_coords = self.resampleContour(
-                    boundaries["outer"], NUM_EDGE_POINTS
-                )
+            with self.timer.stage("resampling"):
+                if boundaries["outer"] is not None:
+                    outer_coords = self.resampleContour(boundaries["outer"], NUM_EDGE_POINTS)
 
-            if boundaries["inner"] is not None:
-                inner_coords = self.resampleContour(
-                    boundaries["inner"], NUM_EDGE_POINTS
-                )
+                if boundaries["inner"] is not None:
+                    inner_coords = self.resampleContour(boundaries["inner"], NUM_EDGE_POINTS)
 
             return {
                 "success": True,
                 "outer_boundary": outer_coords,
                 "inner_boundary": inner_coords,
                 "error": None,
+                "boundary_selection": self.boundary_selection,
             }
 
         except Exception as e:
-            return {
-                "success": False,
-                "outer_boundary": [],
-                "inner_boundary": [],
-                "error": str(e),
-            }
-
+            return failure_result(str(e))
+
+
+def handle_worker_request(processor, request):
+    """Process one decoded worker request and return the response dict"""
+    if not isinstance(request, dict) or not request.get("img_path"):
+        return failure_result("No image path provided")
+    if not isinstance(request["img_path"], str):
+        return failure_result("img_path must be a string")
+    output_file = request.get("output_file")
+    if output_file is not None and not isinstance(output_file, str):
+        return failure_result("output_file must be a string")
+
+    result = processor.processImageForCSharp(request["img_path"])
+    if not output_file:
+        return result
+
+    # Keep the response line small when the caller reads the file anyway
+    with processor.timer.stage("serialization"):
+        written = write_result(result, output_file, request.get("binary_header", False))
+    if not written:
+        return {
+            "success": False,
+            "output_file": output_file,
+            "error": "Failed to write output file",
+        }
+    response = {
+        "success": result["success"],
+        "output_file": output_file,
+        "error": result["error"],
+    }
+    if "timings" in result:
+        response["timings"] = result["timings"]
+    return response
+
+
+def run_worker(processor, input_stream=None, output_stream=None):
+    """Serve JSON-lines requests with one long-lived processor"""
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+
+    for line in input_stream:
+        line = line.strip()
+        if not line:
+            continue
 
-def write_result_to_file(result, output_file):
-    """Write result to file instead of printing to stdout"""
-    try:
-        with open(output_file, "w") as f:
-            json.dump(result, f, separators=(",", ":"))
-        return True
-    except Exception as e:
-        print(f"Error writing to file: {e}", file=sys.stderr)
-        return False
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            response = failure_result(f"Invalid request: {e}")
+        else:
+            command = request.get("command") if isinstance(request, dict) else None
+            if command == "shutdown":
+                break
+            if command == "stats":
+                cache = processor.result_cache
+                response = {"cache": cache.stats() if cache is not None else None}
+            else:
+                try:
+                    response = handle_worker_request(processor, request)
+                except Exception as e:
+                    # A bad request must not stop the requests queued behind it
+                    response = failure_result(str(e))
+            if isinstance(request, dict) and "id" in request:
+                response["id"] = request["id"]
+
+        output_stream.write(result_to_json(response) + "\n")
+        output_stream.flush()
+
+
+def collect_images(source):
+    """Expand a directory or glob pattern into a sorted list of image paths"""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    else:
+        paths = [path for path in glob.glob(source) if os.path.isfile(path)]
+    return sorted(paths)
+
+
+def batch_output_names(images, extension):
+    """Result file name per image, with a numeric suffix on repeated names"""
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in images]
+    # Compared case-insensitively, as on Windows and macOS file systems
+    reserved = {stem.lower() for stem in stems}
+    used = {BATCH_SUMMARY_NAME} if extension == ".json" else set()
+    names = []
+    for stem in stems:
+        name, suffix = stem, 1
+        while name.lower() in used or (name != stem and name.lower() in reserved):
+            name = f"{stem}_{suffix}"
+            suffix += 1
+        used.add(name.lower())
+        names.append(name + extension)
+    return names
+
+
+_batch_processor = None
+
+
+def _init_batch_worker(processor_options=None, processor_factory=None, setup=None):
+    global _batch_processor
+    # Each pool process already owns a core, so keep OpenCV single-threaded
+    cv.setNumThreads(1)
+    if setup is not None:
+        setup()
+    factory = processor_factory or TrackProcessor
+    _batch_processor = factory(**(processor_options or {}))
+
+
+def process_batch_image(img_path, output_file, binary_header=False):
+    """Process one image inside a pool worker, reusing its processor"""
+    if _batch_processor is None:
+        _init_batch_worker()
+
+    cache = _batch_processor.result_cache
+    hits_before = cache.hits if cache is not None else 0
+
+    start = time.perf_counter()
+    result = _batch_processor.processImageForCSharp(img_path)
+    written = write_result(result, output_file, binary_header)
+
+    entry = {
+        "img_path": img_path,
+        "output_file": output_file,
+        "success": result["success"] and written,
+        "error": result["error"] if written else "Failed to write output file",
+        "seconds": time.perf_counter() - start,
+        "cache_hit": cache is not None and cache.hits > hits_before,
+    }
+    if "timings" in result:
+        entry["timings"] = result["timings"]
+    return entry
+
+
+def run_batch(
+    source,
+    output_dir,
+    jobs=None,
+    output_format="json",
+    binary_header=False,
+    processor_options=None,
+    processor_factory=None,
+    worker_setup=None,
+    mp_context=None,
+    verbose=True,
+):
+    """Process every image in a directory or glob across a process pool"""
+    images = sorted(source) if isinstance(source, list) else collect_images(source)
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(images) or 1))
+    extension = ".bin" if output_format == "binary" else ".json"
+
+    start = time.perf_counter()
+    entries = []
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=mp_context,
+        initializer=_init_batch_worker,
+        initargs=(processor_options, processor_factory, worker_setup),
+    ) as pool:
+        futures = {}
+        for img_path, name in zip(images, batch_output_names(images, extension)):
+            output_file = os.path.join(output_dir, name)
+            future = pool.submit(process_batch_image, img_path, output_file, binary_header)
+            futures[future] = (img_path, output_file)
+
+        for future in as_completed(futures):
+            img_path, output_file = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                entry = {
+                    "img_path": img_path,
+                    "output_file": output_file,
+                    "success": False,
+                    "error": str(e),
+                    "seconds": None,
+                    "cache_hit": False,
+                }
+            entries.append(entry)
+
+            status = "OK  " if entry["success"] else "FAIL"
+            seconds = f"{entry['seconds']:.2f}s" if entry["seconds"] is not None else "-"
+            line = f"{status} {seconds:>8} {img_path}"
+            if not entry["success"]:
+                line += f": {entry['error']}"
+            if verbose:
+                print(line)
+
+    wall_time = time.perf_counter() - start
+    entries.sort(key=lambda entry: entry["img_path"])
+    failures = [entry for entry in entries if not entry["success"]]
+    timed = [entry["seconds"] for entry in entries if entry["seconds"] is not None]
+
+    summary = {
+        "source": source,
+        "output_directory": output_dir,
+        "jobs": jobs,
+        "images": len(entries),
+        "succeeded": len(entries) - len(failures),
+        "failed": len(failures),
+        "wall_seconds": wall_time,
+        "images_per_second": len(entries) / wall_time if wall_time > 0 else 0.0,
+        "mean_image_seconds": sum(timed) / len(timed) if timed else 0.0,
+        "cache_hits": sum(entry["cache_hit"] for entry in entries),
+        "results": entries,
+    }
+
+    with open(os.path.join(output_dir, BATCH_SUMMARY_NAME + ".json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    if not verbose:
+        return summary
+    print(
+        f"\nProcessed {summary['images']} images with {jobs} workers in {wall_time:.2f}s "
+        f"({summary['images_per_second']:.2f} images/s), "
+        f"{summary['succeeded']} succeeded, {summary['failed']} failed"
+    )
+    for entry in failures:
+        print(f"  failed: {entry['img_path']}: {entry['error']}")
+
+    return summary
+
+
+def point_shift(points, expected):
+    """Largest distance in pixels between corresponding points of two resampled boundaries"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    expected = np.asarray(expected, dtype=np.float64).reshape(-1, 2)
+    if points.shape != expected.shape:
+        return float("inf")
+    return float(np.hypot(*(points - expected).T).max(initial=0.0))
+
+
+def check_cell_filter(source, tolerance=0.0):
+    """Images whose cell-filtered boundaries differ from the full path by more than ``tolerance`` px"""
+    full = TrackProcessor()
+    cell_filter = TrackProcessor(skip_uniform_cells=True)
+    # Filter cell by cell even where the whole ROI would be faster
+    cell_filter.MAX_MIXED_CELLS = 1.0
+
+    failed = []
+    for img_path in collect_images(source):
+        expected = full.processImageForCSharp(img_path)
+        result = cell_filter.processImageForCSharp(img_path)
+        if not expected["success"] or not result["success"]:
+            matches = expected["success"] == result["success"]
+            print(f"{img_path}: {'ok' if matches else 'FAILED'} (full: {expected['error']}, cell filter: {result['error']})")
+        else:
+            max_px = max(point_shift(result[key], expected[key]) for key in ("outer_boundary", "inner_boundary"))
+            matches = max_px <= tolerance
+            print(f"{img_path}: {'ok' if matches else 'FAILED'} (max {max_px:.2f} px)")
+        if not matches:
+            failed.append(img_path)
+    return failed
+
+
+def add_service_arguments(parser, jobs_help):
+    """Worker, batch, result cache and timing options shared by the TrackProcessor and CNN command lines"""
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Serve JSON-lines requests on stdin/stdout with one warm processor",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="SOURCE",
+        help="Process every image in a directory or glob pattern",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="processedTracks/batch",
+        help="Directory for batch result files (default: processedTracks/batch)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help=jobs_help,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Reuse results for previously seen images from this directory",
+    )
+    parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+        help="Evict least recently used cache entries beyond this size",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Add per-stage wall time and peak memory to each result",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Write a Chrome trace of the stages (chrome://tracing, Perfetto)",
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract outer and inner track boundaries from a track image")
+    parser.add_argument("img_path", nargs="?", help="Path to the track image")
+    parser.add_argument(
+        "output_file",
+        nargs="?",
+        help="Write the result here instead of stdout (.bin for EdgeData binary)",
+    )
+    add_service_arguments(parser, "Number of batch worker processes (default: number of cores)")
+    parser.add_argument(
+        "--format",
+        choices=["json", "binary"],
+        default="json",
+        help="Batch result file format (default: json)",
+    )
+    parser.add_argument(
+        "--binary-header",
+        action="store_true",
+        help="Prefix binary results with a version and status header",
+    )
+    parser.add_argument(
+        "--cell-filter",
+        action="store_true",
+        help="Only run the filters on grid cells with both dark and clear pixels nearby",
+    )
+    parser.add_argument(
+        "--check-cell-filter",
+        metavar="SOURCE",
+        help="Compare cell-filtered and full boundaries over a directory or glob",
+    )
+    parser.add_argument(
+        "--check-tolerance",
+        type=float,
+        metavar="PX",
+        default=0.0,
+        help="Only for --check-cell-filter: largest boundary difference in pixels it accepts (default: 0)",
+    )
+    return parser.parse_args(argv)
 
 
 def main():
-    if len(sys.argv) < 2:
-        result = {
-            "success": False,
-            "outer_boundary": [],
-            "inner_boundary": [],
-            "error": "No image path provided",
-        }
-        if len(sys.argv) >= 3:
-            write_result_to_file(result, sys.argv[2])
-        else:
-            print(json.dumps(result, separators=(",", ":")))
+    args = parse_args()
+
+    processor_options = {
+        "skip_uniform_cells": args.cell_filter,
+        "instrument": args.timings or bool(args.trace),
+    }
+    if args.cache_dir:
+        processor_options["result_cache"] = ResultCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+
+    if args.worker:
+        run_worker(TrackProcessor(**processor_options))
+        sys.exit(0)
+
+    if args.check_cell_filter:
+        sys.exit(1 if check_cell_filter(args.check_cell_filter, args.check_tolerance) else 0)
+
+    if args.batch:
+        summary = run_batch(
+            args.batch,
+            args.output_dir,
+            args.jobs,
+            args.format,
+            args.binary_header,
+            processor_options,
+        )
+        sys.exit(0 if summary["images"] and not summary["failed"] else 1)
+
+    if args.img_path is None:
+        result = failure_result("No image path provided")
+        print(result_to_json(result))
         sys.exit(1)
 
-    img_path = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) >= 3 else None
+    img_path = args.img_path
+    output_file = args.output_file
 
-    processor = TrackProcessor()
+    processor = TrackProcessor(**processor_options)
     result = processor.processImageForCSharp(img_path)
 
-    if output_file:
-        # Write to file
-        if write_result_to_file(result, output_file):
-            sys.exit(0 if result["success"] else 1)
+    with processor.timer.stage("serialization"):
+        if output_file:
+            # Write to file
+            written = write_result(result, output_file, args.binary_header)
         else:
-            sys.exit(2)  # File write error
-    else:
-        # Fallback to stdout (for backwards compatibility)
-        print(json.dumps(result, separators=(",", ":")))
-        sys.exit(0 if result["success"] else 1)
+            # Fallback to stdout (for backwards compatibility)
+            print(result_to_json(result))
+            written = True
+
+    if args.trace:
+        processor.timer.write_chrome_trace(args.trace)
+
+    if not written:
+        sys.exit(2)  # File write error
+    sys.exit(0 if result["success"] else 1)
 
 
 if __name__ == "__main__":